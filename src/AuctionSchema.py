@@ -0,0 +1,204 @@
+import time
+import threading
+from collections import Counter
+from functools import lru_cache
+from datetime import datetime, timedelta
+
+from DSTCalendar import toEpoch
+from logging_config import setup_logging
+logger = setup_logging()
+
+# Typed schema of the normalized JAO and SEECAO records.
+# Capacities and prices are floats, participant counts ints and years ints, with None
+# for missing values instead of "N/D". Market periods are UTC epoch seconds (the stop
+# is the end of the period) and Maintenances is always a list of
+# {"start": epoch, "stop": epoch, "capacity": float} entries, plus "details" when the
+# upstream entry carries other fields.
+
+placeholders = frozenset(("N/D", "n/d", "", "-", "none", "None", "null"))
+
+maintenanceStartKeys = ("start", "periodStart", "from", "dateFrom", "startDate", "maintenanceStart", "dayFrom")
+maintenanceStopKeys = ("stop", "end", "periodStop", "periodEnd", "to", "dateTo", "endDate", "maintenanceEnd", "dayTo")
+maintenanceCapacityKeys = ("capacity", "reducedCapacity", "offeredCapacity", "atc", "value")
+
+invalidValues = Counter()  # field -> values that could not be converted, since the last report
+reportLock = threading.Lock()
+
+
+def isMissing(value):
+    return value is None or (isinstance(value, str) and value.strip() in placeholders)
+
+
+def invalid(field):
+    with reportLock:
+        invalidValues[field] += 1
+    return None
+
+
+def floatField(field):
+    def convert(value):
+        if value.__class__ is float:
+            return value
+        if value.__class__ is int:
+            return float(value)
+        if isMissing(value) or isinstance(value, bool):
+            return None
+        try:
+            return float(str(value).replace(",", "."))
+        except ValueError:
+            return invalid(field)
+    return convert
+
+
+def intField(field):
+    def convert(value):
+        if value.__class__ is int:
+            return value
+        if isMissing(value) or isinstance(value, bool):
+            return None
+        try:
+            return int(float(str(value).replace(",", ".")))
+        except ValueError:
+            return invalid(field)
+    return convert
+
+
+def textField(field):
+    def convert(value):
+        return None if isMissing(value) else str(value)
+    return convert
+
+
+@lru_cache(maxsize=65536)
+def parsePeriod(value, end):
+    # ISO 8601 with an offset is UTC, without one it is CET/CEST wall-clock time.
+    # A date-only end includes that whole day.
+    parsed = datetime.fromisoformat(value.replace("Z", "+00:00"))
+    if parsed.tzinfo is not None:
+        return int(parsed.timestamp())
+    if end and len(value) == 10:
+        parsed += timedelta(days=1)
+    return toEpoch(parsed)
+
+
+def periodField(field, end = False):
+    def convert(value):
+        if isinstance(value, int) and not isinstance(value, bool):
+            return value
+        if isMissing(value):
+            return None
+        try:
+            return parsePeriod(str(value), end)
+        except ValueError:
+            return invalid(field)
+    return convert
+
+
+def firstOf(entry, keys):
+    for key in keys:
+        if key in entry:
+            return key, entry[key]
+    return None, None
+
+
+toPeriodStart = periodField("Maintenances")
+toPeriodStop = periodField("Maintenances", end=True)
+toCapacity = floatField("Maintenances")
+
+
+def maintenancesField(field):
+    def convert(value):
+        if isMissing(value) or value == [] or value == {}:
+            return []
+        if isinstance(value, dict):
+            value = [value]
+        if not isinstance(value, list):
+            return [{"start": None, "stop": None, "capacity": None, "details": value}]
+
+        maintenances = []
+        for entry in value:
+            if not isinstance(entry, dict):
+                maintenances.append({"start": None, "stop": None, "capacity": None, "details": entry})
+                continue
+            startKey, start = firstOf(entry, maintenanceStartKeys)
+            stopKey, stop = firstOf(entry, maintenanceStopKeys)
+            capacityKey, capacity = firstOf(entry, maintenanceCapacityKeys)
+            maintenance = {"start": toPeriodStart(start), "stop": toPeriodStop(stop), "capacity": toCapacity(capacity)}
+            details = {key: item for key, item in entry.items() if key not in (startKey, stopKey, capacityKey)}
+            if details:
+                maintenance["details"] = details
+            maintenances.append(maintenance)
+        return maintenances
+    return convert
+
+
+# Field order matches the normalizers in GetJAO and GetSEECAO
+schema = [
+    ('Year', intField),
+    ('Month', textField),
+    ('Border', textField),
+    ('Market period start', periodField),
+    ('Market period stop', lambda field: periodField(field, end=True)),
+    ('AuctionId', textField),
+    ('TimeTable', textField),
+    ('OfferedCapacity (MW)', floatField),
+    ('Return (MW)', floatField),
+    ('ATC (MW)', floatField),
+    ('Total requested capacity (MW)', floatField),
+    ('Price (€/MWH)', floatField),
+    ('Total allocated capacity (MW)', floatField),
+    ('Number of participants', intField),
+    ('Awarded participants', intField),
+    ('Additional information', textField),
+    ('Maintenances', maintenancesField),
+    ('Source', textField),
+]
+converters = [(field, makeConverter(field)) for field, makeConverter in schema]
+
+
+def typeRecords(records):
+    # Converts a batch of normalized records to the typed schema in one pass
+    return [{field: convert(record.get(field)) for field, convert in converters} for record in records]
+
+
+def reportInvalidValues():
+    # Logs and resets the count of values that did not match the schema
+    with reportLock:
+        report = dict(invalidValues)
+        invalidValues.clear()
+    if report:
+        logger.warning(f"Values that did not match the record schema were stored as null: {report}")
+    return report
+
+
+if __name__ == "__main__":
+    # Benchmark: validation throughput on a mix of JAO- and SEECAO-shaped records
+    records = []
+    for index in range(200000):
+        records.append({
+            'Year': "2024" if index % 2 else 2024,
+            'Month': "Jan",
+            'Border': "AT-CZ",
+            'Market period start': "2023-12-31T23:00:00Z" if index % 2 else "2024-01-01",
+            'Market period stop': "2024-01-31T23:00:00Z" if index % 2 else "2024-01-31",
+            'AuctionId': f"JAO-AT-CZ-M-BASE-240101-{index:06d}",
+            'TimeTable': "00:00-24:00",
+            'OfferedCapacity (MW)': 100 if index % 2 else "100.5",
+            'Return (MW)': "N/D",
+            'ATC (MW)': 250,
+            'Total requested capacity (MW)': 400.0,
+            'Price (€/MWH)': "1,25" if index % 3 else 1.25,
+            'Total allocated capacity (MW)': 100,
+            'Number of participants': 12,
+            'Awarded participants': "N/D",
+            'Additional information': '-',
+            'Maintenances': 'none' if index % 4 else [{"periodStart": "2024-01-10", "periodStop": "2024-01-12", "reducedCapacity": 50}],
+            'Source': "JAO" if index % 2 else "SEECAO",
+        })
+
+    start = time.perf_counter()
+    typed = typeRecords(records)
+    end = time.perf_counter()
+
+    logger.info(f"Typed {len(typed)} records in {end-start:.3f}sec ({len(typed) / (end-start):,.0f} records/sec).")
+    reportInvalidValues()
@@ -0,0 +1,325 @@
+import os
+import re
+import json
+import time
+import math
+from datetime import datetime, timezone
+
+from HourlyCapacity import parseTimeTable
+from logging_config import setup_logging
+logger = setup_logging()
+
+# Cross-source border index and merged per-border, per-period view of JAO and SEECAO.
+# JAO records carry the corridorCode as Border ("AT-CZ"), SEECAO records its label
+# without spaces ("AL-GR", sometimes with other separators or area names). Both are
+# mapped to one canonical "<from>-<to>" border of ISO country codes (bidding zones where
+# a country has several, e.g. DK1). The merged view is a hash join of the per-source
+# aggregates on (border, year, month, product), with the month of the market period,
+# written to borderViewFileName:
+#   borders   canonical border -> {"pair", "aliases": {source: [Border values]}}
+#   areas     area -> canonical borders touching it, to find neighbouring borders
+#   columns   names of the values in every row
+#   periods   canonical border -> rows, one per (year, month, product), with JAO and
+#             SEECAO values side by side (null where a source has no auction)
+# BORDER_TABLE can name a JSON file of extra {"areas": {alias: area}, "borders": {alias: border}}.
+
+borderViewFileName = "auctions_borders.json"
+sources = ("JAO", "SEECAO")
+
+# Area names that are not ISO country codes
+areaAliases = {
+    "GER": "DE", "DE-LU": "DE", "DELU": "DE", "DE/LU": "DE",
+    "IT-NORD": "IT", "NORD": "IT", "ITN": "IT", "IT-N": "IT",
+    "EL": "GR", "GRE": "GR",
+    "UK": "GB",
+    "KS": "XK", "KO": "XK", "KOS": "XK",
+    "BH": "BA", "BIH": "BA",
+    "MNE": "ME", "CG": "ME",
+    "SRB": "RS", "SR": "RS",
+    "MKD": "MK", "NMK": "MK",
+    "ALB": "AL",
+    "TUR": "TR",
+    "BUL": "BG",
+    "ROU": "RO", "ROM": "RO",
+    "CRO": "HR",
+    "SLO": "SI",
+}
+
+# Whole borders that cannot be split by separator
+borderAliases = {}
+
+separators = re.compile(r"\s*(?:<>|<->|->|>|/|–|—|_|\|)\s*")
+multiPartAreas = sorted((alias for alias in areaAliases if "-" in alias), key=len, reverse=True)
+
+
+def loadBorderTable():
+    tableFileName = os.environ.get("BORDER_TABLE")
+    if not tableFileName:
+        return
+    with open(tableFileName, 'r') as file:
+        table = json.load(file)
+    areaAliases.update({alias.upper(): area for alias, area in table.get("areas", {}).items()})
+    borderAliases.update({alias.upper(): border for alias, border in table.get("borders", {}).items()})
+    multiPartAreas[:] = sorted((alias for alias in areaAliases if "-" in alias), key=len, reverse=True)
+
+loadBorderTable()
+
+
+def splitBorder(text):
+    # (from area, to area) of a border name, or None
+    for alias in multiPartAreas:
+        if text.startswith(alias + "-"):
+            return alias, text[len(alias) + 1:]
+        if text.endswith("-" + alias):
+            return text[:-len(alias) - 1], alias
+    parts = text.split("-")
+    if len(parts) == 2 and all(parts):
+        return parts[0], parts[1]
+    return None
+
+
+canonicalCache = {}
+
+def canonicalBorder(border):
+    # Canonical "<from>-<to>" of a JAO corridorCode or SEECAO label, the cleaned name if it cannot be split
+    cached = canonicalCache.get(border)
+    if cached is not None:
+        return cached
+
+    text = separators.sub("-", str(border or "").strip().upper()).replace(" ", "")
+    if text in borderAliases:
+        canonical = borderAliases[text]
+    else:
+        areas = splitBorder(text)
+        if areas is None:
+            canonical = text
+        else:
+            canonical = "-".join(areaAliases.get(area, area) for area in areas)
+
+    canonicalCache[border] = canonical
+    return canonical
+
+
+def undirected(border):
+    return "-".join(sorted(border.split("-", 1)))
+
+
+def productOf(timetable):
+    firstHour, endHour, workingDays = parseTimeTable(timetable)
+    if workingDays:
+        return "peak"
+    if firstHour == 0 and endHour == 24:
+        return "base"
+    return f"{firstHour:02d}-{endHour:02d}"
+
+
+monthNames = ("Jan", "Feb", "Mar", "Apr", "May", "Jun", "Jul", "Aug", "Sep", "Oct", "Nov", "Dec")
+
+def normalizeMonth(month):
+    # "Jan" for 1, "01", "January" or "JAN"; other values unchanged
+    text = str(month).strip()
+    if text.isdigit() and 1 <= int(text) <= 12:
+        return monthNames[int(text) - 1]
+    name = text[:3].title()
+    return name if name in monthNames else month
+
+
+def periodOf(record):
+    # (year, month) of a record, month "Y" for yearly auctions. JAO and SEECAO spell Month
+    # differently, so it is taken from the market period start where there is one: the
+    # periods start at local midnight, up to two hours before the UTC day.
+    month = record.get('Month')
+    start = record.get('Market period start')
+    if isinstance(start, int):
+        periodStart = datetime.fromtimestamp(start + 12 * 3600, timezone.utc)
+        return periodStart.year, "Y" if month == "Y" else monthNames[periodStart.month - 1]
+    return record.get('Year'), month if month == "Y" else normalizeMonth(month)
+
+
+def toFloat(value):
+    if value is None or isinstance(value, bool):
+        return None
+    try:
+        value = float(value)
+    except (TypeError, ValueError):
+        return None
+    return None if math.isnan(value) else value
+
+
+# Per-source aggregate of one (border, year, month, product):
+# [auctions, offered, allocated, price x allocated, price sum, prices, start, stop]
+AUCTIONS, OFFERED, ALLOCATED, WEIGHTED, PRICESUM, PRICES, START, STOP = range(8)
+
+def aggregateSources(records):
+    # One pass over the records, hashed per source on the join key
+    sides = {source: {} for source in sources}
+    aliases = {}
+    for record in records:
+        source = record.get('Source')
+        side = sides.get(source)
+        if side is None:
+            continue
+        border = record.get('Border')
+        canonical = canonicalBorder(border)
+        aliases.setdefault(canonical, {}).setdefault(source, set()).add(border)
+
+        key = (canonical, *periodOf(record), productOf(record.get('TimeTable')))
+        entry = side.get(key)
+        if entry is None:
+            entry = side[key] = [0, 0.0, 0.0, 0.0, 0.0, 0, None, None]
+
+        entry[AUCTIONS] += 1
+        offered = toFloat(record.get('OfferedCapacity (MW)'))
+        allocated = toFloat(record.get('Total allocated capacity (MW)'))
+        price = toFloat(record.get('Price (€/MWH)'))
+        if offered is not None:
+            entry[OFFERED] += offered
+        if allocated is not None:
+            entry[ALLOCATED] += allocated
+        if price is not None:
+            entry[PRICESUM] += price
+            entry[PRICES] += 1
+            if allocated:
+                entry[WEIGHTED] += price * allocated
+
+        start, stop = record.get('Market period start'), record.get('Market period stop')
+        if isinstance(start, int) and (entry[START] is None or start < entry[START]):
+            entry[START] = start
+        if isinstance(stop, int) and (entry[STOP] is None or stop > entry[STOP]):
+            entry[STOP] = stop
+    return sides, aliases
+
+
+def sideValues(entry):
+    # [auctions, offered, allocated, price] of one source, price weighted by allocated capacity
+    if entry is None:
+        return [None, None, None, None]
+    if entry[ALLOCATED]:
+        price = entry[WEIGHTED] / entry[ALLOCATED]
+    elif entry[PRICES]:
+        price = entry[PRICESUM] / entry[PRICES]
+    else:
+        price = None
+    return [entry[AUCTIONS], round(entry[OFFERED], 3), round(entry[ALLOCATED], 3),
+            round(price, 4) if price is not None else None]
+
+
+columns = ["year", "month", "product", "start", "stop"] + \
+          [f"{source.lower()}_{name}" for source in sources for name in ("auctions", "offered", "allocated", "price")]
+
+def joinSources(sides):
+    # Full outer hash join: the smaller side is the build table, the other probes it
+    build, probe = sorted(sources, key=lambda source: len(sides[source]))
+    table = sides[build]
+    matched = set()
+    rows = []
+
+    def emit(key, entries):
+        border, year, month, product = key
+        starts = [entry[START] for entry in entries.values() if entry is not None and entry[START] is not None]
+        stops = [entry[STOP] for entry in entries.values() if entry is not None and entry[STOP] is not None]
+        row = [year, month, product, min(starts) if starts else None, max(stops) if stops else None]
+        for source in sources:
+            row += sideValues(entries.get(source))
+        rows.append((border, row))
+
+    for key, entry in sides[probe].items():
+        buildEntry = table.get(key)
+        if buildEntry is not None:
+            matched.add(key)
+        emit(key, {probe: entry, build: buildEntry})
+    for key, entry in table.items():
+        if key not in matched:
+            emit(key, {build: entry})
+    return rows, len(matched)
+
+
+def buildBorderView(records):
+    start = time.perf_counter()
+    sides, aliases = aggregateSources(records)
+    rows, matched = joinSources(sides)
+
+    periods = {}
+    for border, row in rows:
+        periods.setdefault(border, []).append(row)
+    for borderRows in periods.values():
+        borderRows.sort(key=lambda row: (row[3] is None, row[3] or 0, row[1] == "Y", row[2]))
+
+    areas = {}
+    for border in periods:
+        for area in border.split("-", 1):
+            areas.setdefault(area, []).append(border)
+
+    view = {
+        "generated": time.time(),
+        "borders": {border: {"pair": undirected(border),
+                             "aliases": {source: sorted(map(str, names)) for source, names in aliases.get(border, {}).items()}}
+                    for border in sorted(periods)},
+        "areas": {area: sorted(borders) for area, borders in sorted(areas.items())},
+        "columns": columns,
+        "periods": periods,
+    }
+    shared = sum(1 for border in view["borders"].values() if len(border["aliases"]) > 1)
+    logger.info(f"Merged border view: {len(periods)} borders ({shared} in both sources), {len(rows)} periods, "
+                f"{matched} joined, in {time.perf_counter() - start:.2f}sec.")
+    return view
+
+
+def writeBorderView(records, fileName = borderViewFileName):
+    view = buildBorderView(records)
+    with open(fileName, 'w') as file:
+        json.dump(view, file, separators=(",", ":"))
+    return fileName
+
+
+def checkJoin():
+    # A JAO and a SEECAO auction of the same border and month land in one row, whatever their Month spelling
+    january = 1704063600  # 2024-01-01 00:00 CET
+    records = [
+        {'Source': "JAO", 'Border': "HU-HR", 'Year': 2024, 'Month': "Jan", 'TimeTable': "00:00-24:00",
+         'Market period start': january, 'OfferedCapacity (MW)': 100.0},
+        {'Source': "SEECAO", 'Border': "HU-HR", 'Year': 2024, 'Month': "JANUARY", 'TimeTable': "00:00-24:00",
+         'Market period start': january, 'OfferedCapacity (MW)': 50.0},
+        {'Source': "SEECAO", 'Border': "HR-HU", 'Year': 2024, 'Month': 1, 'TimeTable': "00:00-24:00",
+         'OfferedCapacity (MW)': 25.0},
+    ]
+    view = buildBorderView(records)
+    rows = view["periods"]["HU-HR"]
+    assert len(rows) == 1, rows
+    row = dict(zip(columns, rows[0]))
+    assert (row["year"], row["month"], row["jao_offered"], row["seecao_offered"]) == (2024, "Jan", 100.0, 50.0), row
+    assert dict(zip(columns, view["periods"]["HR-HU"][0]))["month"] == "Jan"
+    logger.info("JAO and SEECAO records of the same border and month are joined.")
+
+
+if __name__ == "__main__":
+    import random
+
+    checkJoin()
+
+    # Benchmark: a year of monthly and yearly auctions on JAO and SEECAO borders, some shared
+    jaoBorders = ["AT-CZ", "CZ-AT", "HU-HR", "HR-HU", "SI-HR", "HR-SI", "DE-LU-AT", "IT-NORD-AT"]
+    seecaoBorders = ["HR-HU", "HU-HR", "AL - GR", "GR - AL", "BA-HR", "HR-BA", "ME-KS", "KS-ME", "EL-BG"]
+    records = []
+    for index in range(200000):
+        source = "JAO" if index % 2 else "SEECAO"
+        border = random.choice(jaoBorders if source == "JAO" else seecaoBorders)
+        month = random.randint(1, 12)
+        records.append({
+            'Year': 2024,
+            'Month': "Y" if index % 13 == 0 else ["Jan", "Feb", "Mar", "Apr", "May", "Jun", "Jul", "Aug", "Sep", "Oct", "Nov", "Dec"][month - 1],
+            'Border': border.replace(" ", "") if source == "SEECAO" else border,
+            'Market period start': 1704063600 + month * 2592000,
+            'Market period stop': 1704063600 + (month + 1) * 2592000,
+            'TimeTable': random.choice(("00:00-24:00", "Peak", "Base")),
+            'OfferedCapacity (MW)': random.uniform(0, 500),
+            'Total allocated capacity (MW)': random.choice((None, random.uniform(0, 400))),
+            'Price (€/MWH)': random.uniform(0, 5),
+            'Source': source,
+        })
+
+    start = time.perf_counter()
+    view = buildBorderView(records)
+    size = len(json.dumps(view, separators=(",", ":")))
+    logger.info(f"Built the view of {len(records)} records in {time.perf_counter() - start:.2f}sec, {size / 1024:.0f}KB.")
+    logger.info(f"Canonical borders: {sorted(view['borders'])}")
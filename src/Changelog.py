@@ -0,0 +1,189 @@
+import os
+import json
+import time
+import hashlib
+import tempfile
+
+from MemoryBudget import spillDir
+from logging_config import setup_logging
+logger = setup_logging()
+
+# Differential changelog between consecutive aggregations.
+# Records are keyed on a hash of (AuctionId, TimeTable). The index of the last published
+# snapshot (key -> [record hash, AuctionId, TimeTable]) is diffed against the new dataset
+# in a single pass, producing a versioned patch of added, changed and removed records.
+# Clients holding version N apply patches N+1, N+2, ... instead of refetching auctions.json.
+
+indexFileName = "auctions_index.json"
+versionFileName = "auctions_version.json"
+patchFileName = "auctions_patch_{version}.json"
+keptPatches = int(os.environ.get("CHANGELOG_KEPT_PATCHES", 30))
+
+
+def recordKey(record):
+    return hashlib.sha1(f"{record.get('AuctionId')}|{record.get('TimeTable')}".encode()).hexdigest()[:16]
+
+
+def recordHash(record):
+    return hashlib.sha1(json.dumps(record, sort_keys=True).encode()).hexdigest()[:16]
+
+
+def loadIndex(download = None):
+    # Local index first, then the published one (the container's disk does not survive restarts)
+    try:
+        with open(indexFileName, 'r') as file:
+            return json.load(file)
+    except (FileNotFoundError, ValueError):
+        pass
+
+    if download is not None:
+        content = download(indexFileName)
+        if content:
+            return json.loads(content)
+    return {"version": 0, "patches": [], "keys": {}}
+
+
+def diff(records, previousIndex, onAdded = None, onChanged = None, complete = True):
+    # Linear in the size of both datasets. Added and changed records are handed to the
+    # callbacks as they are found rather than kept, only their counts are returned.
+    # An incomplete dataset (a run with gaps) removes nothing: the previous entries of
+    # keys it lacks are carried forward, they may only be missing from a failed unit.
+    previousKeys = previousIndex["keys"]
+    keys = {}
+    added = changed = 0
+
+    for record in records:
+        key = recordKey(record)
+        hashed = recordHash(record)
+        keys[key] = [hashed, record.get('AuctionId'), record.get('TimeTable')]
+
+        previous = previousKeys.get(key)
+        if previous is None:
+            added += 1
+            if onAdded is not None:
+                onAdded(record)
+        elif previous[0] != hashed:
+            changed += 1
+            if onChanged is not None:
+                onChanged(record)
+
+    removed = []
+    for key, entry in previousKeys.items():
+        if key in keys:
+            continue
+        if complete:
+            removed.append([entry[1], entry[2]])
+        else:
+            keys[key] = entry
+    return added, changed, removed, keys
+
+
+def writePatch(fileName, records, previousIndex, version, complete = True):
+    # Streams the patch into fileName: added records straight into its "added" array,
+    # changed ones through a temporary file in SPILL_DIR until the pass is done
+    with open(fileName, 'w') as file, \
+            tempfile.TemporaryFile('w+', dir=spillDir, prefix="changed-", suffix=".jsonl") as changedFile:
+        file.write(f'{{"from_version": {previousIndex["version"]}, "to_version": {version}, "added": [')
+        written = 0
+
+        def onAdded(record):
+            nonlocal written
+            file.write((", " if written else "") + json.dumps(record))
+            written += 1
+
+        def onChanged(record):
+            changedFile.write(json.dumps(record) + "\n")
+
+        added, changed, removed, keys = diff(records, previousIndex, onAdded, onChanged, complete)
+
+        file.write('], "changed": [')
+        changedFile.seek(0)
+        for index, line in enumerate(changedFile):
+            file.write((", " if index else "") + line.rstrip("\n"))
+        file.write('], "removed": ')
+        json.dump(removed, file)
+        file.write("}")
+    return added, changed, removed, keys
+
+
+indexReplaced = False  # the local index was replaced by the last buildChangelog
+
+
+def buildChangelog(records, download = None, complete = True):
+    # Writes the patch, version and index files and returns (files, manifests, expired):
+    # the files to publish, the manifests to publish in order once they are (they announce
+    # the new version), and the patches no longer listed, to delete once the manifests are
+    # published. A run that changed nothing publishes no new version. If publishing fails,
+    # discardChangelog restores the previous index.
+    global indexReplaced
+    indexReplaced = False
+    previousIndex = loadIndex(download)
+    start = time.perf_counter()
+
+    version = previousIndex["version"] + 1
+    previousPatches = previousIndex.get("patches", [])
+    patches = previousPatches
+    files = []
+
+    if previousIndex["version"]:
+        fileName = patchFileName.format(version=version)
+        added, changed, removed, keys = writePatch(fileName, records, previousIndex, version, complete)
+        if not (added or changed or removed):
+            os.remove(fileName)
+            logger.info(f"Changelog: no changes since v{previousIndex['version']}.")
+            return [], [], []
+        files.append(fileName)
+        patches = (patches + [version])[-keptPatches:]
+    else:
+        # The first version has no patch, clients fetch auctions.json
+        added, changed, removed, keys = diff(records, previousIndex, complete=complete)
+
+    expired = [patchFileName.format(version=expiredVersion) for expiredVersion in previousPatches
+               if expiredVersion not in patches]
+    for expiredFile in expired:
+        if os.path.exists(expiredFile):
+            os.remove(expiredFile)
+
+    index = {"version": version, "patches": patches, "keys": keys}
+    with open(versionFileName, 'w') as file:
+        # Clients on a version older than the first kept patch have to refetch auctions.json
+        json.dump({"version": version, "patches": patches, "updated": time.time()}, file)
+    if os.path.exists(indexFileName):
+        os.replace(indexFileName, f"{indexFileName}.prev")
+    elif os.path.exists(f"{indexFileName}.prev"):
+        os.remove(f"{indexFileName}.prev")
+    with open(indexFileName, 'w') as file:
+        json.dump(index, file)
+    indexReplaced = True
+    manifests = [indexFileName, versionFileName]
+
+    logger.info(f"Changelog v{version}: {added} added, {changed} changed, {len(removed)} removed "
+                f"in {time.perf_counter() - start:.2f}sec.")
+    return files, manifests, expired
+
+
+def discardChangelog():
+    global indexReplaced
+    if not indexReplaced:
+        return
+    if os.path.exists(f"{indexFileName}.prev"):
+        os.replace(f"{indexFileName}.prev", indexFileName)
+    elif os.path.exists(indexFileName):
+        os.remove(indexFileName)
+    indexReplaced = False
+
+
+def applyPatch(records, patch):
+    # Reference client implementation: returns records updated from patch["from_version"] to patch["to_version"]
+    removed = {recordKey({'AuctionId': auctionId, 'TimeTable': timetable}) for auctionId, timetable in patch["removed"]}
+    replacements = {recordKey(record): record for record in patch["changed"]}
+
+    patched = []
+    for record in records:
+        key = recordKey(record)
+        if key in removed:
+            continue
+        patched.append(replacements.pop(key, record))
+    patched.extend(replacements.values())
+    patched.extend(patch["added"])
+    return patched
@@ -0,0 +1,104 @@
+from array import array
+from functools import lru_cache
+from datetime import datetime, timedelta, timezone
+
+# Precomputed CET/CEST calendars, one per year.
+# The EU switches to CEST (UTC+2) at 01:00 UTC on the last Sunday of March and
+# back to CET (UTC+1) at 01:00 UTC on the last Sunday of October.
+
+CET = timedelta(hours=1)
+CEST = timedelta(hours=2)
+
+
+def lastSunday(year, month):
+    if month == 12:
+        lastDay = datetime(year + 1, 1, 1) - timedelta(days=1)
+    else:
+        lastDay = datetime(year, month + 1, 1) - timedelta(days=1)
+    return lastDay - timedelta(days=(lastDay.weekday() - 6) % 7)
+
+
+@lru_cache(maxsize=None)
+def transitions(year):
+    # UTC instants at which CEST starts and ends
+    dstStart = lastSunday(year, 3).replace(hour=1, tzinfo=timezone.utc)
+    dstEnd = lastSunday(year, 10).replace(hour=1, tzinfo=timezone.utc)
+    return dstStart, dstEnd
+
+
+class YearCalendar:
+    # Hour index i of a year is the UTC hour starting at start + i hours, where start
+    # is local midnight on January 1st. Local days map to contiguous index ranges of
+    # 23, 24 or 25 hours.
+    def __init__(self, year):
+        self.year = year
+        dstStart, dstEnd = transitions(year)
+
+        firstDay = datetime(year, 1, 1)
+        self.days = (datetime(year + 1, 1, 1) - firstDay).days
+
+        # Start index of every local day, plus the end of the year
+        self.start = int((firstDay - CET).replace(tzinfo=timezone.utc).timestamp())
+        self.dayOffsets = array('l')
+        self.weekdays = bytearray()
+        for day in range(self.days + 1):
+            localMidnight = firstDay + timedelta(days=day)
+            utcMidnight = (localMidnight - CET).replace(tzinfo=timezone.utc)
+            if dstStart <= utcMidnight - CET < dstEnd:
+                utcMidnight -= CEST - CET
+            self.dayOffsets.append((int(utcMidnight.timestamp()) - self.start) // 3600)
+            self.weekdays.append(localMidnight.weekday())
+        self.hours = self.dayOffsets[-1]
+
+        # Local hour of day of every hour index. 02:00 is skipped on the spring day and
+        # repeated on the autumn day.
+        self.localHours = bytearray(self.hours)
+        springIndex = (int(dstStart.timestamp()) - self.start) // 3600
+        autumnIndex = (int(dstEnd.timestamp()) - self.start) // 3600
+        for day in range(self.days):
+            first, last = self.dayOffsets[day], self.dayOffsets[day + 1]
+            labels = list(range(24))
+            if first <= springIndex < last:
+                labels.remove(2)
+            elif first <= autumnIndex < last:
+                labels.insert(2, 2)
+            self.localHours[first:last] = bytes(labels)
+
+    def offsetAt(self, day):
+        # UTC offset at local midnight of a day of the year
+        utcMidnight = self.start + self.dayOffsets[day] * 3600
+        localMidnight = (datetime(self.year, 1, 1) + timedelta(days=day)).replace(tzinfo=timezone.utc).timestamp()
+        return timedelta(seconds=localMidnight - utcMidnight)
+
+    def indexOf(self, epoch):
+        # Hour index of a UTC epoch, may fall outside of [0, hours)
+        return (int(epoch) - self.start) // 3600
+
+    def localToIndex(self, localTime):
+        # Hour index of a naive CET/CEST wall-clock time
+        day = (localTime - datetime(self.year, 1, 1)).days
+        if day < 0 or day >= self.days:
+            return self.indexOf(toEpoch(localTime))
+        first = self.dayOffsets[day]
+        labels = self.localHours[first:self.dayOffsets[day + 1]]
+        hour = localTime.hour
+        # Skipped hours map to the next existing one
+        while hour < 24 and hour not in labels:
+            hour += 1
+        return first + (labels.index(hour) if hour < 24 else len(labels))
+
+
+@lru_cache(maxsize=None)
+def calendar(year):
+    return YearCalendar(year)
+
+
+def utcOffset(localTime):
+    # CET/CEST offset of a naive wall-clock time
+    dstStart, dstEnd = transitions(localTime.year)
+    utcTime = (localTime - CET).replace(tzinfo=timezone.utc)
+    return CEST if dstStart <= utcTime < dstEnd else CET
+
+
+def toEpoch(localTime):
+    return int((localTime - utcOffset(localTime)).replace(tzinfo=timezone.utc).timestamp())
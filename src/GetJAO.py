@@ -2,18 +2,24 @@ import asyncio
 import aiohttp
 from aiohttp import ClientSession, ServerDisconnectedError
 
+import os
 import json
 import time
+import threading
 from datetime import datetime, timedelta
 import tracemalloc
 
-from logging_config import setup_logging
+from RunJournal import RunJournal
+from MemoryBudget import AdaptiveLimiter
+from RecordStore import newRecordStore
+from Profiling import instrumentLoop
+from AuctionSchema import typeRecords
+from RequestPolicy import Deadline, DeadlineExceeded, LatencyTracker, hedged
+import RunMetrics
+from logging_config import setup_logging, ProgressLog
 logger = setup_logging()
 
-unwantedBorders = []
-corridors = []
-all_data = []
-date_ranges = []
+unwantedBorders = set()
 
 headers = {
     'Accept': 'application/json, text/plain, */*',
@@ -31,7 +37,18 @@ headers = {
     'sec-ch-ua-platform': '"Windows"'
 }
 
-async def getCorridors(session, horizon, retries = 3, delay = 1):
+# Corridor discovery is cached in memory and on disk, and shared by every collector in the run
+horizons = ("Monthly", "Yearly")
+corridorCacheFileName = os.environ.get("JAO_CORRIDOR_CACHE", "jao_corridors.json")
+corridorCacheTTL = int(os.environ.get("JAO_CORRIDOR_CACHE_TTL", 24 * 3600))  # seconds
+
+corridorHorizons = {}  # corridor code -> set of horizons it is auctioned in
+corridorsFetchedAt = 0
+corridorLock = threading.Lock()
+
+auctionLatency = LatencyTracker("JAO auction")
+
+async def getCorridors(session, horizon, deadline, retries = 3):
     url = 'https://www.jao.eu/api/v1/auction/calls/getcorridorhorizonpairs'
     payload = json.dumps({
         "horizon": horizon
@@ -43,45 +60,95 @@ async def getCorridors(session, horizon, retries = 3, delay = 1):
             async with session.post(url, headers=headers, data=payload) as response:
                 if response.status == 200:
                     data = await response.json()
-                    # Extract corridorCode values into a list
-                    global corridors
-                    for item in data:
-                        border = item["corridorCode"]
-                        if border not in unwantedBorders and border not in corridors:
-                            corridors.append(border)
+                    # Extract corridorCode values into a set
+                    corridors = {item["corridorCode"] for item in data}
                          
                     logger.info(f"Collected corridor pairs from JAO. Horizon {horizon}.")
-                    return
+                    return corridors
                 else:
-                    logger.info(f"Failed pairs retrieval for horizon {horizon}. Status code: {response.status}.\nReason:")
+                    logger.info(f"Failed pairs retrieval for horizon {horizon}. Status code: {response.status}. Attempt {attempt} of {retries}.")
                     if (response.status == 405 or response.status == 400):
                         response_text = await response.text()
-                        logger.info("Unhandled Bad Request: ", response_text)
-                        requestFailed = True           
+                        logger.info("Unhandled Bad Request: %s", response_text)
+                    requestFailed = True
         
         except ServerDisconnectedError:
-            logger.info(f"Server disconnected. Attempt {attempt} of {retries}. Retrying in {delay} seconds...")
+            logger.info(f"Server disconnected. Attempt {attempt} of {retries}. Retrying...")
             requestFailed = True
         except aiohttp.ClientError as e:
-            logger.info(f"Client error: {e}. Attempt {attempt} of {retries}. Retrying in {delay} seconds...")
+            logger.info(f"Client error: {e}. Attempt {attempt} of {retries}. Retrying...")
             requestFailed = True
         except Exception as e:
-            logger.info(f"Unexpected error: {e}. Attempt {attempt} of {retries}. Retrying in {delay} seconds...")
+            logger.info(f"Unexpected error: {e}. Attempt {attempt} of {retries}. Retrying...")
             requestFailed = True
         except InterruptedError as e:
             logger.info("Interrupt instruction received")
             break
             
-        if requestFailed:   
-            await asyncio.sleep(delay)
+        if requestFailed and attempt < retries:
+            await deadline.backoff(attempt)
             
     if requestFailed:  
         # If all retries fail, raise an exception
         raise Exception(f"Failed to fetch {url} after {retries} attempts.")        
-                
-                    
+
+
+async def fetchCorridorHorizons(deadline):
+    # Fetch the corridor pairs of every horizon in one pass
+    async with ClientSession(timeout=deadline.clientTimeout()) as session:
+        responses = await deadline.run(asyncio.gather(*(getCorridors(session, horizon, deadline) for horizon in horizons)))
+
+    # A horizon without pairs is a failed lookup, never cached as "no corridors"
+    mapping = {}
+    for horizon, corridors in zip(horizons, responses):
+        if not corridors:
+            raise Exception(f"JAO returned no corridor pairs for horizon {horizon}.")
+        for border in corridors:
+            mapping.setdefault(border, set()).add(horizon)
+    return mapping
+
+
+def loadCorridorHorizons(deadline):
+    # Must be called outside of a running event loop
+    global corridorHorizons, corridorsFetchedAt
+    with corridorLock:
+        now = time.time()
+        if corridorHorizons and now - corridorsFetchedAt < corridorCacheTTL:
+            return corridorHorizons
+
+        try:
+            with open(corridorCacheFileName, 'r') as file:
+                cached = json.load(file)
+            if now - cached["fetched_at"] < corridorCacheTTL:
+                corridorHorizons = {border: set(pairHorizons) for border, pairHorizons in cached["corridors"].items()}
+                corridorsFetchedAt = cached["fetched_at"]
+                logger.info(f"Loaded JAO corridor pairs from {corridorCacheFileName}.")
+                return corridorHorizons
+        except (FileNotFoundError, ValueError, KeyError):
+            pass
+
+        corridorHorizons = asyncio.run(fetchCorridorHorizons(deadline))
+        corridorsFetchedAt = now
+
+        # Write to a temporary file first so a concurrent reader never sees a partial cache
+        tempFileName = f"{corridorCacheFileName}.tmp"
+        with open(tempFileName, 'w') as file:
+            json.dump({
+                "fetched_at": corridorsFetchedAt,
+                "corridors": {border: sorted(pairHorizons) for border, pairHorizons in corridorHorizons.items()}
+            }, file)
+        os.replace(tempFileName, corridorCacheFileName)
+
+        return corridorHorizons
+
+
+def getCorridorsFor(horizon, deadline):
+    mapping = loadCorridorHorizons(deadline)
+    return sorted(border for border, pairHorizons in mapping.items()
+                  if horizon in pairHorizons and border not in unwantedBorders)
+
         
-async def fetch_auction(session, corridor, date_range, horizon, retries = 3, delay = 1):
+async def fetch_auction(session, corridor, date_range, horizon, deadline, retries = 3):
     url = "https://www.jao.eu/api/v1/auction/calls/getauctions"
     
     payload = json.dumps({
@@ -90,100 +157,163 @@ async def fetch_auction(session, corridor, date_range, horizon, retries = 3, del
         'fromdate': date_range['fromdate'],
         'todate': date_range['todate']
     })
-    
+
+    async def request():
+        started = time.monotonic()
+        async with session.post(url, headers=headers, data=payload) as response:
+            body = await response.read()
+            RunMetrics.observe("JAO auction", time.monotonic() - started, len(body))
+            if response.status == 200:
+                data = json.loads(body)
+                # Per-request lines are debug only, progress is summarized by the caller
+                logger.debug("Collected %s auction for %s from %s to %s.", horizon, corridor, date_range['fromdate'], date_range['todate'])
+                return data
+            else:
+                logger.debug("Failed data retrieval for %s from %s to %s. Status code: %s.", corridor, date_range['fromdate'], date_range['todate'], response.status)
+                if (response.status == 405 or response.status == 400):
+                    response_text = body.decode(errors="replace")
+                    
+                    # Look for the keyword "\u0022No Data found\u0022" in the response text
+                    if '\\u0022No Data found\\u0022' in response_text:
+                        logger.debug("No Data found.")
+                    else:
+                        logger.warning("Unhandled Bad Request: %s", response_text)
+                        
+                return None
         
     for attempt in range(1, retries + 1):
-        requestFailed = False
         try:
-            async with session.post(url, headers=headers, data=payload) as response:
-                if response.status == 200:
-                    data = await response.json()
-                    logger.info(f"Collected {horizon} auction for {corridor} from {date_range['fromdate']} to {date_range['todate']}.")
-                    return data
-                else:
-                    logger.info(f"Failed data retrieval for {corridor} from {date_range['fromdate']} to {date_range['todate']}. Status code: {response.status}.\nReason:")
-                    if (response.status == 405 or response.status == 400):
-                        response_text = await response.text()
-                        
-                        # Look for the keyword "\u0022No Data found\u0022" in the response text
-                        if '\\u0022No Data found\\u0022' in response_text:
-                            logger.info("No Data found.")
-                        else:
-                            logger.warning("Unhandled Bad Request: ", response_text)
-                            
-                    return None
+            # Slow outliers get a duplicate request, the first answer wins
+            return await hedged(request, auctionLatency)
         except ServerDisconnectedError:
-            logger.info(f"Server disconnected. Attempt {attempt} of {retries}. Retrying in {delay} seconds...")
-            requestFailed = True
+            logger.info(f"Server disconnected. Attempt {attempt} of {retries}. Retrying...")
         except aiohttp.ClientError as e:
-            logger.info(f"Client error: {e}. Attempt {attempt} of {retries}. Retrying in {delay} seconds...")
-            requestFailed = True
+            logger.info(f"Client error: {e}. Attempt {attempt} of {retries}. Retrying...")
+        except asyncio.TimeoutError:
+            logger.info(f"Request timed out. Attempt {attempt} of {retries}. Retrying...")
         except Exception as e:
-            logger.info(f"Unexpected error: {e}. Attempt {attempt} of {retries}. Retrying in {delay} seconds...")
-            requestFailed = True
+            logger.info(f"Unexpected error: {e}. Attempt {attempt} of {retries}. Retrying...")
     
-        if requestFailed:   
-            await asyncio.sleep(delay)
+        if attempt < retries:
+            await deadline.backoff(attempt)
     
     # If all retries fail, raise an exception
     raise Exception(f"Failed to fetch {url} after {retries} attempts.")     
         
 
-async def aggregate(horizon):
-    async with ClientSession() as session:
-        await getCorridors(session, horizon)
-        tasks = []
+def jaoUnit(horizon, corridor, date_range):
+    # Journal key of one getauctions request
+    return f"JAO|{horizon}|{corridor}|{date_range['fromdate']}|{date_range['todate']}"
+
+
+async def aggregate(horizon, corridors, date_ranges, journal, all_data, deadline):
+    instrumentLoop()
+    seen = set()  # (AuctionId, TimeTable) of records already normalized
+    cancelled = 0
+    limiter = AdaptiveLimiter()
+    progress = ProgressLog(logger, f"JAO {horizon} auctions", len(corridors) * len(date_ranges))
+
+    async def fetchUnit(session, unit, corridor, date_range):
+        # Responses go straight to the journal and are read back one at a time below
+        try:
+            async with limiter:
+                data = await fetch_auction(session, corridor, date_range, horizon, deadline)
+        except Exception:
+            progress.update("failed")
+            raise
+        journal.record(unit, data)
+        progress.update("collected" if data else "empty")
+
+    async with ClientSession(timeout=deadline.clientTimeout()) as session:
+        units = []
+        tasks = {}
         for corridor in corridors:
             for date_range in date_ranges:
-                tasks.append(fetch_auction(session, corridor, date_range, horizon))
-
-        responses = await asyncio.gather(*tasks)
-
-        for data in responses:
-            if data:
-                for auction in data:
-                    results = auction.get('results', [])
-                    products = auction.get('products', []) 
-                    for product in products:
-                        for result in results:
-                            auctionID = auction.get('identification', 'N/D')
+                unit = jaoUnit(horizon, corridor, date_range)
+                units.append(unit)
+                # Units completed by a previous, failed run are served from the journal
+                if unit not in journal:
+                    tasks[unit] = asyncio.ensure_future(fetchUnit(session, unit, corridor, date_range))
+                else:
+                    progress.update("journaled")
+
+        try:
+            await deadline.run(asyncio.gather(*tasks.values(), return_exceptions=True))
+        except DeadlineExceeded as e:
+            # The outstanding requests are cancelled, their units are left to the next run
+            logger.warning(f"{e}. Cancelled {sum(task.cancelled() for task in tasks.values())} outstanding JAO {horizon} requests.")
+        progress.finish()
+        auctionLatency.report()
+
+    for unit, task in tasks.items():
+        if task.cancelled() or not task.done():
+            journal.addGap(unit, DeadlineExceeded("Cancelled at the run deadline"))
+        elif task.exception() is not None:
+            journal.addGap(unit, task.exception())
+
+    for unit in units:
+        data = journal.get(unit)
+        batch = []
+        if data:
+            for auction in data:
+                results = auction.get('results', [])
+                products = auction.get('products', []) 
+                for product in products:
+                    # Results that name their product hour belong to that product only
+                    productHour = product.get('productHour', 'N/D')
+                    for result in results:
+                        if result.get('productHour', productHour) != productHour:
+                            continue
+                        auctionID = auction.get('identification', 'N/D')
+                        
+                        if (auction.get('cancelled')):
+                            cancelled += 1
+                            logger.debug("Cancelled auction skipped. (%s)", auctionID)
+                        else:
+
+                            # Extract the last 9 characters from auction ID
+                            last_9_chars = auctionID.split('-')[-2]  # Splits by '-' and takes the last part
+                            year = f"20{last_9_chars[:2]}"  # First two characters represent the year
+                            month = datetime(int(year), int(last_9_chars[2:4]), 1).strftime('%b')   # Next two characters represent the month
                             
-                            if (auction.get('cancelled')):
-                                logger.info(f"Cancelled auction skipped. ({auctionID})")
-                            else:
-
-                                # Extract the last 9 characters from auction ID
-                                last_9_chars = auctionID.split('-')[-2]  # Splits by '-' and takes the last part
-                                year = f"20{last_9_chars[:2]}"  # First two characters represent the year
-                                month = datetime(int(year), int(last_9_chars[2:4]), 1).strftime('%b')   # Next two characters represent the month
-                                
-                                if horizon == "Yearly":
-                                    month = "Y"
-
-                                newAuction = {
-                                    'Year': year,
-                                    'Month': month,
-                                    'Border': auction.get('corridorCode', 'N/D'),
-                                    'Market period start': auction.get('marketPeriodStart'),
-                                    'Market period stop': auction.get('marketPeriodStop'),
-                                    'AuctionId': auctionID,
-                                    'TimeTable': product.get('productHour', 'N/D'),
-                                    'OfferedCapacity (MW)': result.get('offeredCapacity', "N/D"),
-                                    'Return (MW)': product.get('resoldCapacity', "N/D"),
-                                    'ATC (MW)': product.get('atc', "N/D"),
-                                    'Total requested capacity (MW)': result.get('requestedCapacity', "N/D"),
-                                    'Price (€/MWH)': result.get('auctionPrice', "N/D"),
-                                    'Total allocated capacity (MW)': result.get('allocatedCapacity', "N/D"),
-                                    'Number of participants': product.get('bidderPartyCount', "N/D"),
-                                    'Awarded participants': product.get('winnerPartyCount', "N/D"),
-                                    'Additional information': auction.get('additionalMessage', '-'),
-                                    'Maintenances': auction.get('maintenances', 'none'),
-                                    'Source': "JAO"
-                                }
-                                if newAuction not in all_data:
-                                    all_data.append(newAuction)
-
-def getJao(start_date, end_date, horizon):
+                            if horizon == "Yearly":
+                                month = "Y"
+
+                            newAuction = {
+                                'Year': year,
+                                'Month': month,
+                                'Border': auction.get('corridorCode', 'N/D'),
+                                'Market period start': auction.get('marketPeriodStart'),
+                                'Market period stop': auction.get('marketPeriodStop'),
+                                'AuctionId': auctionID,
+                                'TimeTable': productHour,
+                                'OfferedCapacity (MW)': result.get('offeredCapacity', "N/D"),
+                                'Return (MW)': product.get('resoldCapacity', "N/D"),
+                                'ATC (MW)': product.get('atc', "N/D"),
+                                'Total requested capacity (MW)': result.get('requestedCapacity', "N/D"),
+                                'Price (€/MWH)': result.get('auctionPrice', "N/D"),
+                                'Total allocated capacity (MW)': result.get('allocatedCapacity', "N/D"),
+                                'Number of participants': product.get('bidderPartyCount', "N/D"),
+                                'Awarded participants': product.get('winnerPartyCount', "N/D"),
+                                'Additional information': auction.get('additionalMessage', '-'),
+                                'Maintenances': auction.get('maintenances', 'none'),
+                                'Source': "JAO"
+                            }
+                            # The natural key of RecordStore and Changelog, the first record of a key wins
+                            key = (auctionID, newAuction['TimeTable'])
+                            if key not in seen:
+                                seen.add(key)
+                                batch.append(newAuction)
+
+        # One typed validation pass per response
+        all_data.extend(typeRecords(batch))
+
+    if cancelled:
+        logger.info(f"Skipped {cancelled} cancelled JAO {horizon} auction results.")
+    return all_data
+
+def getDateRanges(start_date, end_date, horizon):
+    date_ranges = []
 
     if horizon == "Yearly":
         # Initialize the starting year for the loop
@@ -232,10 +362,21 @@ def getJao(start_date, end_date, horizon):
             # Move to the next month for the next iteration
             current_start_date = next_month_start_date
     
-    #out of loop
-    asyncio.run(aggregate(horizon))
+    return date_ranges
 
-    return all_data
+def getJao(start_date, end_date, horizon, journal = None, records = None, deadline = None):
+    if journal is None:
+        journal = RunJournal(start_date, end_date)
+    if records is None:
+        records = newRecordStore()
+    if deadline is None:
+        deadline = Deadline()
+    deadline.check()
+
+    date_ranges = getDateRanges(start_date, end_date, horizon)
+    corridors = getCorridorsFor(horizon, deadline)
+
+    return asyncio.run(aggregate(horizon, corridors, date_ranges, journal, records, deadline))
 
     
 if __name__ == "__main__":
@@ -248,7 +389,7 @@ if __name__ == "__main__":
     yearly_auctions = getJao(start_date, end_date, "Yearly")
     monthly_auctions = getJao(start_date, end_date, "Monthly")
     
-    all_data = yearly_auctions + monthly_auctions
+    all_data = list(yearly_auctions) + list(monthly_auctions)
 
     if all_data:
         jaoTestFileName = "jao_test.json"
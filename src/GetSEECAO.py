@@ -1,35 +1,79 @@
 from RequestSEECAOAreas import getAreas
-from RequestSEECAOBorders import getAuctions
+from RequestSEECAOBorders import streamAuctions
+from SEECAOSpecStore import getCachedSpec, storeSpec, saveSpecs, isFinal
+from RunJournal import RunJournal
+from MemoryBudget import AdaptiveLimiter
+from RecordStore import newRecordStore
+from Profiling import instrumentLoop
+from AuctionSchema import typeRecords
+from RequestPolicy import Deadline, DeadlineExceeded, LatencyTracker, hedged
+import RunMetrics
 
+import os
 import json
 import time
-from time import sleep
-from datetime import datetime
+from datetime import datetime, timedelta
 import tracemalloc
 
 import asyncio
 import aiohttp
 from aiohttp import ClientSession, ServerDisconnectedError
 
-from logging_config import setup_logging
+from logging_config import setup_logging, ProgressLog
 logger = setup_logging()
 
 retries = 3
-delay = 1
-def getSEECAO(start_date, end_date, horizon):
+
+# filter_export is split into concurrent (border group, date window) requests
+bordersPerRequest = int(os.environ.get("SEECAO_BORDERS_PER_REQUEST", 4))
+windowDays = int(os.environ.get("SEECAO_WINDOW_DAYS", 366))
+exportConcurrency = int(os.environ.get("SEECAO_EXPORT_CONCURRENCY", 4))
+
+specLatency = LatencyTracker("SEECAO specification")
+
+areasUnit = "SEECAO|areas"
+
+def exportUnit(horizon, group, fromDate, toDate):
+    # Journal key of one filter_export request
+    return f"SEECAO|{horizon}|export|{','.join(map(str, group))}|{fromDate}|{toDate}"
+
+def specUnit(auctionID):
+    return f"SEECAO|spec|{auctionID}"
+
+def getSEECAO(start_date, end_date, horizon, journal = None, records = None, deadline = None):
+    if journal is None:
+        journal = RunJournal(start_date, end_date)
+    if records is None:
+        records = newRecordStore()
+    if deadline is None:
+        deadline = Deadline()
+    deadline.check()
+
+    if areasUnit in journal:
+        id_list = journal.get(areasUnit)
+    else:
+        id_list = getBorderIds(horizon, deadline)
+        journal.record(areasUnit, id_list)
+
+    return asyncio.run(collectAuctions(start_date, end_date, horizon, id_list, journal, records, deadline))
+
+def getBorderIds(horizon, deadline):
     #get all area code pairs from SEECAO
     for attempt in range(1, retries + 1):
         requestFailed = False
         try:
-            area_data = getAreas()
+            area_data = getAreas(timeout=deadline.requestsTimeout())
             parsed_area_data = json.loads(area_data)
+            break
             
+        except DeadlineExceeded:
+            raise
         except Exception as e:
-            logger.error(f"Unexpected error: {e}. Attempt {attempt} of {retries}. Retrying in {delay} seconds...")
+            logger.error(f"Unexpected error: {e}. Attempt {attempt} of {retries}.")
             requestFailed = True
             
-        if requestFailed:   
-            sleep(delay)
+        if requestFailed and attempt < retries:
+            deadline.backoffSync(attempt)
             
     if requestFailed:  
         # If all retries fail, raise an exception
@@ -45,88 +89,190 @@ def getSEECAO(start_date, end_date, horizon):
     for key in border_id_by_label:
         id_list.append(border_id_by_label[key])
 
-    #format parameters
-    fromDate = start_date.strftime('%Y-%m-%d')
-    toDate = end_date.strftime('%Y-%m-%d')
+    return id_list
+
+def getDateWindows(start_date, end_date):
+    # Inclusive (dayFrom, dayTo) windows of at most windowDays days
+    windows = []
+    windowStart = start_date.date()
+    while windowStart <= end_date.date():
+        windowEnd = min(windowStart + timedelta(days=windowDays - 1), end_date.date())
+        windows.append((windowStart.strftime('%Y-%m-%d'), windowEnd.strftime('%Y-%m-%d')))
+        windowStart = windowEnd + timedelta(days=1)
+    return windows
+
+def getBorderGroups(id_list):
+    return [id_list[i:i + bordersPerRequest] for i in range(0, len(id_list), bordersPerRequest)]
+
+async def collectAuctions(start_date, end_date, horizon, id_list, journal, processedAuctions, deadline):
+    instrumentLoop()
+    limiter = AdaptiveLimiter()
+    exportLimiter = asyncio.Semaphore(exportConcurrency)
+    progress = ProgressLog(logger, f"SEECAO {horizon} specifications")
+
+    specTasks = {}  # auctionId -> task, shared by every chunk so each spec is requested once
+    failedSpecs = set()
+    seen = set()  # (auctionId, timetable) of auctions already normalized, windows can overlap
+    cancelled = 0
+    storedSpecs = 0
+
+    async def getSpecs(session, auction):
+        auctionID = auction.get("auctionId")
+        unit = specUnit(auctionID)
+
+        # Final specs are served from the store, specs fetched by a failed run from the journal
+        cachedSpecs = getCachedSpec(auctionID)
+        if cachedSpecs is None:
+            cachedSpecs = journal.get(unit)
+        if cachedSpecs is not None:
+            nonlocal storedSpecs
+            storedSpecs += 1
+            RunMetrics.count("SEECAO stored specifications")
+            return cachedSpecs
 
-    #get all auctions matching parameters
-    for attempt in range(1, retries + 1):
-        requestFailed = False
         try:
-            auctionData = getAuctions(fromDate, toDate, id_list, horizon.lower())
-        except:
-            logger.error("Could not get auction data from SEECAO")
-    
-        if requestFailed:
-            sleep(delay)
-    
-    if requestFailed:  
-        # If all retries fail, raise an exception
-        raise Exception(f"Failed to fetch SEECAO's auction data after {retries} attempts.")
-    
-    logger.info(f"Collected auction data from SEECAO. Horizon {horizon}.")
+            async with limiter:
+                data = await getAuctionSpecs(auctionID, session, deadline)
+        except Exception:
+            progress.update("failed")
+            raise
+        journal.record(unit, data)
+        storeSpec(auctionID, data, isFinal(auction))
+        progress.update("collected")
+        return data
 
-    try: #type list
-        auctions = json.loads(auctionData).get("auctions")
-    except Exception as e:
-        raise Exception(f"Failed to parse auction data from SEECAO:\n{e}")
+    def schedule(session, auction):
+        # Starts the spec lookup as soon as the auction has been parsed
+        auctionID = auction.get("auctionId")
+        if auctionID not in specTasks:
+            specTasks[auctionID] = asyncio.ensure_future(getSpecs(session, auction))
+        return specTasks[auctionID]
 
-    asyncio.run(processAuctions(auctions, horizon))
-    
-    return auctions
+    async def normalize(pending):
+        nonlocal cancelled
+        specs = await asyncio.gather(*(task for auction, task in pending), return_exceptions=True)
 
-async def processAuctions(auctionsList, horizon): 
-    async with ClientSession() as session:
-        tasks = []
-        for auction in auctionsList:
+        batch = []
+        for (auction, task), response in zip(pending, specs):
             auctionID = auction.get("auctionId")
-            tasks.append(getAuctionSpecs(auctionID, session))
+            if isinstance(response, BaseException):
+                # Auctions without specs are left out of this run and reported as gaps
+                if auctionID not in failedSpecs:
+                    failedSpecs.add(auctionID)
+                    journal.addGap(specUnit(auctionID), response)
+                continue
 
-        responses = await asyncio.gather(*tasks)
+            key = (auctionID, auction.get('timetable'))
+            if key in seen:
+                continue
+            seen.add(key)
 
-        for response in responses:
-            auctionSpecs = response.get("auctionData")
-            currAuctionID = auctionSpecs.get("auctionIdentification")
-            
-            for auction in auctionsList:
-                if auction.get("auctionId") == currAuctionID:
-                    index = auctionsList.index(auction)
-                    border = auction.get('border', 'N/D').replace(" ", "")
-                    
-                    if horizon.lower() == "yearly":
-                        month = "Y"
-                    else:
-                        month = auction.get("month")
-                    
-                    processedAuction = {
-                                'Year': auction.get("year"),
-                                'Month': month,
-                                'Border': border,
-                                'Market period start': auction.get('deliveryPeriodStart'),
-                                'Market period stop': auction.get('deliveryPeriodEnd'),
-                                'AuctionId': currAuctionID,
-                                'TimeTable': auction.get('timetable', 'N/D'),
-                                'OfferedCapacity (MW)': auction.get('offered', "N/D"),
-                                'Return (MW)': auction.get('return', "N/D"),
-                                'ATC (MW)': auction.get('atc', "N/D"),
-                                'Total requested capacity (MW)': auction.get('requested', "N/D"),
-                                'Price (€/MWH)': auction.get('price', "N/D"),
-                                'Total allocated capacity (MW)': auction.get('allocated', "N/D"),
-                                'Number of participants': auction.get('numberOfParticipants', "N/D"),
-                                'Awarded participants': auction.get('numberOfSuccessfullParticipants', "N/D"),
-                                'Additional information': '-',
-                                'Maintenances': auctionSpecs.get('maintancePeriods', 'none'),
-                                'Source': "SEECAO"
-                            }
-                    
-                    auctionsList.remove(auction)
-                    if not auction.get("cancelled"):
-                        auctionsList.insert(index, processedAuction)
-                    else:
-                        logger.info(f"Removed cancelled auction {currAuctionID}")
+            processedAuction = normalizeAuction(auction, response.get("auctionData"), horizon)
+            if processedAuction is None:
+                cancelled += 1
+            else:
+                batch.append(processedAuction)
+
+        # One typed validation pass per chunk
+        processedAuctions.extend(typeRecords(batch))
+
+    async def exportChunk(session, group, window):
+        fromDate, toDate = window
+        unit = exportUnit(horizon, group, fromDate, toDate)
+
+        if unit in journal:
+            await normalize([(auction, schedule(session, auction)) for auction in journal.get(unit)])
+            return
+
+        for attempt in range(1, retries + 1):
+            pending = []
+            try:
+                async with exportLimiter:
+                    async for auction in streamAuctions(session, fromDate, toDate, group, horizon.lower()):
+                        pending.append((auction, schedule(session, auction)))
+                break
+            except Exception as e:
+                logger.info(f"SEECAO export for borders {group} from {fromDate} to {toDate} failed: {e}. Attempt {attempt} of {retries}.")
+                if attempt == retries:
+                    # Auctions parsed before the failure are still published
+                    await normalize(pending)
+                    raise Exception(f"Failed to fetch SEECAO's auction data after {retries} attempts.")
+                await deadline.backoff(attempt)
+
+        journal.record(unit, [auction for auction, task in pending])
+        RunMetrics.count("SEECAO exported auctions", len(pending))
+        await normalize(pending)
+
+    chunks = [(group, window) for group in getBorderGroups(id_list) for window in getDateWindows(start_date, end_date)]
+    logger.info(f"Requesting SEECAO {horizon} auctions in {len(chunks)} chunks.")
+
+    async with ClientSession(timeout=deadline.clientTimeout()) as session:
+        chunkTasks = [asyncio.ensure_future(exportChunk(session, group, window)) for group, window in chunks]
+        try:
+            await deadline.run(asyncio.gather(*chunkTasks, return_exceptions=True))
+            # Specs scheduled by failed export attempts are still awaited before the session closes
+            await deadline.run(asyncio.gather(*specTasks.values(), return_exceptions=True))
+        except DeadlineExceeded as e:
+            # The outstanding requests are cancelled, their chunks are left to the next run
+            for task in specTasks.values():
+                task.cancel()
+            await asyncio.gather(*specTasks.values(), return_exceptions=True)
+            logger.warning(f"{e}. Cancelled the outstanding SEECAO {horizon} requests.")
+        progress.finish()
+        specLatency.report()
+
+    for (group, (fromDate, toDate)), task in zip(chunks, chunkTasks):
+        unit = exportUnit(horizon, group, fromDate, toDate)
+        if task.cancelled() or not task.done():
+            journal.addGap(unit, DeadlineExceeded("Cancelled at the run deadline"))
+        elif task.exception() is not None:
+            journal.addGap(unit, task.exception())
+
+    saveSpecs()
+    logger.info(f"Used {storedSpecs} stored SEECAO specifications. Horizon {horizon}.")
+    if cancelled:
+        logger.info(f"Removed {cancelled} cancelled SEECAO {horizon} auctions.")
+    return processedAuctions
+
+def normalizeAuction(auction, auctionSpecs, horizon):
+    # Returns None for cancelled auctions
+    currAuctionID = auctionSpecs.get("auctionIdentification")
+        
+    if auction.get("cancelled"):
+        logger.debug("Removed cancelled auction %s", currAuctionID)
+        return None
+    
+    border = auction.get('border', 'N/D').replace(" ", "")
+    
+    if horizon.lower() == "yearly":
+        month = "Y"
+    else:
+        month = auction.get("month")
+    
+    processedAuction = {
+                'Year': auction.get("year"),
+                'Month': month,
+                'Border': border,
+                'Market period start': auction.get('deliveryPeriodStart'),
+                'Market period stop': auction.get('deliveryPeriodEnd'),
+                'AuctionId': currAuctionID,
+                'TimeTable': auction.get('timetable', 'N/D'),
+                'OfferedCapacity (MW)': auction.get('offered', "N/D"),
+                'Return (MW)': auction.get('return', "N/D"),
+                'ATC (MW)': auction.get('atc', "N/D"),
+                'Total requested capacity (MW)': auction.get('requested', "N/D"),
+                'Price (€/MWH)': auction.get('price', "N/D"),
+                'Total allocated capacity (MW)': auction.get('allocated', "N/D"),
+                'Number of participants': auction.get('numberOfParticipants', "N/D"),
+                'Awarded participants': auction.get('numberOfSuccessfullParticipants', "N/D"),
+                'Additional information': '-',
+                'Maintenances': auctionSpecs.get('maintancePeriods', 'none'),
+                'Source': "SEECAO"
+            }
+    return processedAuction
                         
 
-async def getAuctionSpecs(auctionID, session):
+async def getAuctionSpecs(auctionID, session, deadline):
     url = f"https://api.seecao.com/api/data?auctionIdentification={auctionID}"
     headers = {
         'Accept': 'application/json, text/plain, */*',
@@ -144,32 +290,35 @@ async def getAuctionSpecs(auctionID, session):
         'sec-ch-ua-platform': '"Windows"'
         }
 
+    async def request():
+        started = time.monotonic()
+        async with session.get(url, headers=headers) as response:
+            body = await response.read()
+            RunMetrics.observe("SEECAO specification", time.monotonic() - started, len(body))
+            if response.status == 200:
+                data = json.loads(body)
+                # Per-request lines are debug only, progress is summarized by the caller
+                logger.debug("Collected specifications for %s.", auctionID)
+                return data
+            else:
+                response_text = body.decode(errors="replace")
+                raise Exception(f"Status code: {response.status}\nServer response:\n{response_text}")
+
     for attempt in range(1, retries + 1):
-        requestFailed = False
         try:
-            async with session.get(url, headers=headers) as response:
-                if response.status == 200:
-                    data = await response.json()
-                    logger.info(f"Collected specifications for {auctionID}.")
-                    return data
-                else:
-                    logger.info(f"Failed data retrieval for {auctionID}. Status code: {response.status}\nServer response:")
-                    response_text = await response.text()
-                    logger.info(response_text)
-                
-                
+            # Slow outliers get a duplicate request, the first answer wins
+            return await hedged(request, specLatency)
         except ServerDisconnectedError:
-            logger.info(f"Server disconnected. Attempt {attempt} of {retries}. Retrying in {delay} seconds...")
-            requestFailed = True
+            logger.info(f"Server disconnected. Attempt {attempt} of {retries}. Retrying...")
         except aiohttp.ClientError as e:
-            logger.info(f"Client error: {e}. Attempt {attempt} of {retries}. Retrying in {delay} seconds...")
-            requestFailed = True
+            logger.info(f"Client error: {e}. Attempt {attempt} of {retries}. Retrying...")
+        except asyncio.TimeoutError:
+            logger.info(f"Request for {auctionID} timed out. Attempt {attempt} of {retries}. Retrying...")
         except Exception as e:
-            logger.info(f"Unexpected error: {e}. Attempt {attempt} of {retries}. Retrying in {delay} seconds...")
-            requestFailed = True
+            logger.info(f"Failed data retrieval for {auctionID}. {e}. Attempt {attempt} of {retries}.")
 
-        if requestFailed:   
-            await asyncio.sleep(delay)
+        if attempt < retries:
+            await deadline.backoff(attempt)
 
     # If all retries fail, raise an exception
     raise Exception(f"Failed to fetch {url} after {retries} attempts.") 
@@ -185,7 +334,7 @@ if __name__ == "__main__":
     
     yearly_auctions = getSEECAO(start_date, end_date, "Yearly")
     monthly_auctions = getSEECAO(start_date, end_date, "Monthly")
-    all_data = yearly_auctions + monthly_auctions
+    all_data = list(yearly_auctions) + list(monthly_auctions)
     
 
     if all_data:
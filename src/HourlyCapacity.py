@@ -0,0 +1,170 @@
+import re
+import math
+import time
+import bisect
+from array import array
+from functools import lru_cache
+from datetime import datetime, timedelta
+
+from DSTCalendar import calendar
+from logging_config import setup_logging
+logger = setup_logging()
+
+# Expands normalized JAO/SEECAO auction records into hourly UTC series per border.
+# Index i of every series is the hour starting at result["start"] + i * 3600 (UTC).
+
+fields = {
+    "offered": 'OfferedCapacity (MW)',
+    "allocated": 'Total allocated capacity (MW)',
+    "price": 'Price (€/MWH)',
+}
+
+hourRange = re.compile(r"(\d{1,2})(?::\d{2})?\s*-\s*(\d{1,2})(?::\d{2})?")
+NaN = float("nan")
+
+
+def parseTimeTable(timetable):
+    # Local (first hour, end hour, working days only) of a product, base load by default
+    text = str(timetable or "").strip().lower()
+    if "peak" in text and "off" not in text:
+        return 8, 20, True
+
+    match = hourRange.search(text)
+    if match:
+        first, last = int(match.group(1)), int(match.group(2))
+        if last == 0:
+            last = 24
+        if first < last <= 24:
+            return first, last, False
+    return 0, 24, False
+
+
+def toNumber(value):
+    if isinstance(value, bool) or value is None:
+        return NaN
+    if isinstance(value, (int, float)):
+        return float(value)
+    try:
+        return float(str(value).replace(",", "."))
+    except ValueError:
+        # "N/D" and other placeholders
+        return NaN
+
+
+def periodIndex(value, yearCalendar, end = False):
+    # Hour index of a period boundary. Timestamps with an offset and epoch values are UTC,
+    # naive ones are CET/CEST wall-clock times. End boundaries are rounded up.
+    if value is None or isinstance(value, bool):
+        return None
+
+    if isinstance(value, (int, float)):
+        index = (value - yearCalendar.start) / 3600
+        return math.ceil(index) if end else math.floor(index)
+
+    text = str(value)
+    try:
+        parsed = datetime.fromisoformat(text.replace("Z", "+00:00"))
+    except ValueError:
+        return None
+
+    if parsed.tzinfo is not None:
+        index = (parsed.timestamp() - yearCalendar.start) / 3600
+        return math.ceil(index) if end else math.floor(index)
+
+    if end:
+        if len(text) == 10:
+            # A date-only end includes that whole day
+            parsed += timedelta(days=1)
+        elif parsed.minute or parsed.second or parsed.microsecond:
+            parsed = parsed.replace(minute=0, second=0, microsecond=0) + timedelta(hours=1)
+    return yearCalendar.localToIndex(parsed)
+
+
+@lru_cache(maxsize=None)
+def hourPositions(year, firstHour, endHour, workingDays):
+    # Sorted hour indexes of the year covered by a daily product
+    yearCalendar = calendar(year)
+    positions = array('l')
+    localHours = yearCalendar.localHours
+    for day in range(yearCalendar.days):
+        if workingDays and yearCalendar.weekdays[day] >= 5:
+            continue
+        for index in range(yearCalendar.dayOffsets[day], yearCalendar.dayOffsets[day + 1]):
+            if firstHour <= localHours[index] < endHour:
+                positions.append(index)
+    return positions
+
+
+def expandHourly(records, year):
+    yearCalendar = calendar(year)
+    hours = yearCalendar.hours
+    empty = array('d', [NaN]) * hours
+
+    borders = {}  # border -> product ("<horizon> <timetable>") -> field -> array of hourly values
+    for record in records:
+        first = periodIndex(record.get('Market period start'), yearCalendar)
+        last = periodIndex(record.get('Market period stop'), yearCalendar, end=True)
+        if first is None or last is None:
+            continue
+        first, last = max(first, 0), min(last, hours)
+        if first >= last:
+            continue
+
+        horizon = "Yearly" if record.get('Month') == "Y" else "Monthly"
+        product = f"{horizon} {record.get('TimeTable', 'N/D')}"
+        borderSeries = borders.setdefault(record.get('Border'), {})
+        series = borderSeries.get(product)
+        if series is None:
+            series = borderSeries[product] = {name: array('d', empty) for name in fields}
+
+        firstHour, endHour, workingDays = parseTimeTable(record.get('TimeTable'))
+        if firstHour == 0 and endHour == 24 and not workingDays:
+            # Base load covers the whole period, 23- and 25-hour days included
+            for name, field in fields.items():
+                series[name][first:last] = array('d', [toNumber(record.get(field))]) * (last - first)
+        else:
+            positions = hourPositions(year, firstHour, endHour, workingDays)
+            selected = positions[bisect.bisect_left(positions, first):bisect.bisect_left(positions, last)]
+            for name, field in fields.items():
+                value = toNumber(record.get(field))
+                column = series[name]
+                for index in selected:
+                    column[index] = value
+
+    return {"start": yearCalendar.start, "hours": hours, "borders": borders}
+
+
+if __name__ == "__main__":
+    # Benchmark: a full year of monthly and yearly auctions for every border
+    year = 2024
+    records = []
+    for border in range(60):
+        records.append({
+            'Month': "Y",
+            'Border': f"B{border}",
+            'Market period start': f"{year - 1}-12-31T23:00:00Z",
+            'Market period stop': f"{year}-12-31T22:59:59Z",
+            'TimeTable': "00:00-24:00",
+            'OfferedCapacity (MW)': 100,
+            'Total allocated capacity (MW)': 90,
+            'Price (€/MWH)': 1.5,
+        })
+        for month in range(1, 13):
+            periodEnd = datetime(year + (month == 12), month % 12 + 1, 1) - timedelta(days=1)
+            for timetable in ("00:00-24:00", "Peak"):
+                records.append({
+                    'Month': datetime(year, month, 1).strftime('%b'),
+                    'Border': f"B{border}",
+                    'Market period start': f"{year}-{month:02d}-01",
+                    'Market period stop': periodEnd.strftime('%Y-%m-%d'),
+                    'TimeTable': timetable,
+                    'OfferedCapacity (MW)': "50",
+                    'Total allocated capacity (MW)': "N/D",
+                    'Price (€/MWH)': 0.75,
+                })
+
+    start = time.perf_counter()
+    result = expandHourly(records, year)
+    end = time.perf_counter()
+
+    logger.info(f"Expanded {len(records)} records into {len(result['borders'])} borders x {result['hours']} hours in {end-start:.3f}sec.")
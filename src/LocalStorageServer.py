@@ -0,0 +1,276 @@
+import os
+import json
+import time
+import uuid
+import base64
+import random
+import shutil
+import tempfile
+import threading
+from datetime import datetime, timezone
+from urllib.parse import unquote
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+from logging_config import setup_logging
+logger = setup_logging()
+
+# Stand-in for the parts of the Supabase Storage API used by the aggregator, for tests
+# and benchmarks without a Supabase project:
+#   POST /storage/v1/object/<bucket>/<path>          single request upload (x-upsert)
+#   GET  /storage/v1/object/<bucket>/<path>          download
+#   POST /storage/v1/object/list/<bucket>            list (name, created_at, updated_at), honouring search/limit/offset
+#   DELETE /storage/v1/object/<bucket>               delete {"prefixes": [names]}
+#   POST /storage/v1/upload/resumable                TUS creation
+#   HEAD/PATCH /storage/v1/upload/resumable/<id>     TUS offset / chunk
+# failRate drops that fraction of the chunks halfway through, after storing the part received.
+#
+#   python LocalStorageServer.py           benchmark against a server on a random port
+#   python LocalStorageServer.py serve     serve STORAGE_ROOT on STORAGE_PORT (default 9090)
+
+prefix = "/storage/v1"
+
+
+class StorageHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, format, *args):
+        logger.debug("LocalStorageServer: " + format, *args)
+
+    def reply(self, status, body = None, headers = None):
+        data = json.dumps(body).encode() if body is not None else b""
+        self.send_response(status)
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        if body is not None:
+            self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        if self.command != "HEAD":
+            self.wfile.write(data)
+
+    def readBody(self):
+        return self.rfile.read(int(self.headers.get("Content-Length", 0)))
+
+    def do_POST(self):
+        path = unquote(self.path.split("?")[0])
+        if path.startswith(f"{prefix}/object/list/"):
+            options = json.loads(self.readBody() or b"{}")
+            bucket = path[len(f"{prefix}/object/list/"):]
+            items = [item for item in self.server.store.list(bucket) if options.get("search", "") in item["name"]]
+            offset = options.get("offset", 0)
+            return self.reply(200, items[offset:offset + options.get("limit", 100)])
+        if path.startswith(f"{prefix}/object/"):
+            bucket, _, name = path[len(f"{prefix}/object/"):].partition("/")
+            body = self.readBody()
+            if not self.server.store.put(bucket, name, body, self.headers.get("x-upsert") == "true"):
+                return self.reply(400, {"statusCode": "409", "error": "Duplicate", "message": "The resource already exists"})
+            return self.reply(200, {"Key": f"{bucket}/{name}"})
+        if path == f"{prefix}/upload/resumable":
+            self.readBody()
+            metadata = {}
+            for item in self.headers.get("Upload-Metadata", "").split(","):
+                key, _, value = item.strip().partition(" ")
+                metadata[key] = base64.b64decode(value).decode()
+            uploadId = self.server.store.createUpload(
+                metadata.get("bucketName"), metadata.get("objectName"),
+                int(self.headers["Upload-Length"]), self.headers.get("x-upsert") == "true")
+            return self.reply(201, headers={"Location": f"{prefix}/upload/resumable/{uploadId}", "Tus-Resumable": "1.0.0"})
+        self.reply(404, {"error": "not_found"})
+
+    def do_GET(self):
+        path = unquote(self.path.split("?")[0])
+        if path.startswith(f"{prefix}/object/"):
+            bucket, _, name = path[len(f"{prefix}/object/"):].partition("/")
+            data = self.server.store.get(bucket, name)
+            if data is None:
+                return self.reply(400, {"statusCode": "404", "error": "not_found", "message": "Object not found"})
+            self.send_response(200)
+            self.send_header("Content-Type", "application/octet-stream")
+            self.send_header("Content-Length", str(len(data)))
+            self.end_headers()
+            self.wfile.write(data)
+            return
+        self.reply(404, {"error": "not_found"})
+
+    def do_DELETE(self):
+        path = unquote(self.path.split("?")[0])
+        if path.startswith(f"{prefix}/object/"):
+            bucket = path[len(f"{prefix}/object/"):]
+            names = json.loads(self.readBody() or b"{}").get("prefixes", [])
+            return self.reply(200, [{"name": name} for name in names if self.server.store.delete(bucket, name)])
+        self.reply(404, {"error": "not_found"})
+
+    def do_HEAD(self):
+        upload = self.server.store.uploads.get(self.path.rsplit("/", 1)[-1])
+        if upload is None:
+            return self.reply(404)
+        self.reply(200, headers={"Upload-Offset": str(upload["offset"]), "Upload-Length": str(upload["length"]),
+                                 "Tus-Resumable": "1.0.0", "Cache-Control": "no-store"})
+
+    def do_PATCH(self):
+        store = self.server.store
+        uploadId = self.path.rsplit("/", 1)[-1]
+        upload = store.uploads.get(uploadId)
+        length = int(self.headers.get("Content-Length", 0))
+        if upload is None:
+            self.rfile.read(length)
+            return self.reply(404)
+        if int(self.headers["Upload-Offset"]) != upload["offset"]:
+            self.rfile.read(length)
+            return self.reply(409, {"error": "Upload-Offset does not match"})
+
+        if random.random() < self.server.failRate:
+            # Keep half of the chunk and drop the connection
+            store.appendUpload(uploadId, self.rfile.read(length // 2))
+            self.close_connection = True
+            return
+
+        offset = store.appendUpload(uploadId, self.rfile.read(length))
+        self.reply(204, headers={"Upload-Offset": str(offset), "Tus-Resumable": "1.0.0"})
+
+
+class LocalStore:
+    def __init__(self, root):
+        self.root = root
+        self.uploads = {}
+        self.lock = threading.Lock()
+        os.makedirs(os.path.join(root, ".uploads"), exist_ok=True)
+
+    def objectPath(self, bucket, name):
+        path = os.path.normpath(os.path.join(self.root, bucket, name))
+        if not path.startswith(os.path.join(self.root, bucket) + os.sep):
+            raise ValueError(f"Invalid object name {name}")
+        return path
+
+    def put(self, bucket, name, data, upsert):
+        path = self.objectPath(bucket, name)
+        if os.path.exists(path) and not upsert:
+            return False
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmpPath = f"{path}.{uuid.uuid4().hex}.tmp"
+        with open(tmpPath, 'wb') as file:
+            file.write(data)
+        os.replace(tmpPath, path)
+        return True
+
+    def get(self, bucket, name):
+        try:
+            with open(self.objectPath(bucket, name), 'rb') as file:
+                return file.read()
+        except FileNotFoundError:
+            return None
+
+    def delete(self, bucket, name):
+        try:
+            os.remove(os.path.join(self.root, bucket, os.path.basename(name)))
+            return True
+        except FileNotFoundError:
+            return False
+
+    def list(self, bucket):
+        items = []
+        directory = os.path.join(self.root, bucket)
+        for name in sorted(os.listdir(directory) if os.path.isdir(directory) else (), reverse=True):
+            if name.endswith(".tmp"):
+                continue
+            stat = os.stat(os.path.join(directory, name))
+            items.append({
+                "name": name,
+                "created_at": datetime.fromtimestamp(stat.st_ctime, timezone.utc).strftime("%Y-%m-%dT%H:%M:%S.%fZ"),
+                "updated_at": datetime.fromtimestamp(stat.st_mtime, timezone.utc).strftime("%Y-%m-%dT%H:%M:%S.%fZ"),
+                "metadata": {"size": stat.st_size},
+            })
+        return items
+
+    def createUpload(self, bucket, name, length, upsert):
+        uploadId = uuid.uuid4().hex
+        with self.lock:
+            self.uploads[uploadId] = {"bucket": bucket, "name": name, "length": length, "offset": 0, "upsert": upsert}
+        open(os.path.join(self.root, ".uploads", uploadId), 'wb').close()
+        return uploadId
+
+    def appendUpload(self, uploadId, data):
+        upload = self.uploads[uploadId]
+        partPath = os.path.join(self.root, ".uploads", uploadId)
+        with open(partPath, 'ab') as file:
+            file.write(data)
+        upload["offset"] += len(data)
+
+        if upload["offset"] >= upload["length"]:
+            path = self.objectPath(upload["bucket"], upload["name"])
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            os.replace(partPath, path)
+            with self.lock:
+                self.uploads.pop(uploadId)
+        return upload["offset"]
+
+
+def writeSampleAuctions(fileName, megabytes):
+    # An auctions.json shaped file of about this size, for the storage benchmarks
+    record = json.dumps({"Year": 2024, "Month": "Jan", "Border": "AT-CZ", "AuctionId": "JAO-AT-CZ-M-BASE-240101-01",
+                         "TimeTable": "00:00-24:00", "OfferedCapacity (MW)": 100.0, "Price (€/MWH)": 1.25})
+    count = int(megabytes * 1024 * 1024 / (len(record) + 2)) + 1
+    with open(fileName, 'w') as file:
+        file.write("[" + ", ".join([record] * count) + "]")
+
+
+def startServer(root, port = 0, failRate = 0.0):
+    # Serves root on a daemon thread and returns the server; server.server_port is the bound port
+    server = ThreadingHTTPServer(("127.0.0.1", port), StorageHandler)
+    server.daemon_threads = True
+    server.store = LocalStore(root)
+    server.failRate = failRate
+    threading.Thread(target=server.serve_forever, name="local-storage", daemon=True).start()
+    return server
+
+
+if __name__ == "__main__":
+    import sys
+    import asyncio
+    import StorageUpload
+    from StorageUpload import StorageUploader
+
+    if sys.argv[1:] == ["serve"]:
+        root = os.environ.get("STORAGE_ROOT", "local_storage")
+        server = startServer(root, int(os.environ.get("STORAGE_PORT", 9090)))
+        logger.info(f"Serving {root} on http://127.0.0.1:{server.server_port}{prefix}")
+        try:
+            while True:
+                time.sleep(3600)
+        except KeyboardInterrupt:
+            server.shutdown()
+        sys.exit(0)
+
+    # Benchmark: sequential single-request uploads against concurrent chunked uploads,
+    # then chunked uploads with a fraction of the chunks dropped
+    workDir = tempfile.mkdtemp(prefix="storage-bench-")
+    os.chdir(workDir)
+    StorageUpload.uploadStateFileName = os.path.join(workDir, "upload_state.json")
+    StorageUpload.retryDelay = 0.05
+
+    files = {"auctions.json": 60, "auctions_patch_2.json": 8, "aggregation_range.json": 0.001}
+    for fileName, megabytes in files.items():
+        writeSampleAuctions(fileName, megabytes)
+
+    def run(label, failRate, threshold, concurrency):
+        root = tempfile.mkdtemp(dir=workDir)
+        server = startServer(root, failRate=failRate)
+        StorageUpload.resumableThreshold = threshold
+        StorageUpload.uploadConcurrency = concurrency
+        uploader = StorageUploader(f"http://127.0.0.1:{server.server_port}{prefix}", "bench", {})
+
+        start = time.perf_counter()
+        sent = asyncio.run(uploader.uploadFiles({fileName: False for fileName in files}))
+        elapsed = time.perf_counter() - start
+        server.shutdown()
+
+        for fileName in files:
+            with open(fileName, 'rb') as local, open(os.path.join(root, "bench", fileName), 'rb') as remote:
+                assert local.read() == remote.read(), f"{fileName} differs after upload"
+        logger.info(f"{label}: {sum(sent.values()) / 1024 / 1024:.1f}MB in {elapsed:.2f}sec.")
+
+    run("Sequential, single request", 0.0, float("inf"), 1)
+    run("Concurrent, chunked", 0.0, StorageUpload.chunkSize, StorageUpload.uploadConcurrency)
+    run("Concurrent, chunked, 20% of chunks dropped", 0.2, StorageUpload.chunkSize, StorageUpload.uploadConcurrency)
+
+    shutil.rmtree(workDir)
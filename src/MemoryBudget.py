@@ -0,0 +1,172 @@
+import os
+import json
+import time
+import asyncio
+import tempfile
+import threading
+
+from logging_config import setup_logging
+logger = setup_logging()
+
+# Memory budget for aggregation runs, checked against the process RSS.
+# As usage nears the budget the collectors reduce their in-flight requests and
+# spill normalized records to disk, so a large run slows down instead of crashing.
+
+MiB = 1024 * 1024
+
+def getAvailableMemory():
+    # Free memory in bytes, as reported by /proc/meminfo
+    free_memory = 0
+    with open('/proc/meminfo', 'r') as mem:
+        for i in mem:
+            sline = i.split()
+            if str(sline[0]) in ('MemFree:', 'Buffers:', 'Cached:'):
+                free_memory += int(sline[1])
+    return free_memory * 1024
+
+def getBudget():
+    # MEMORY_BUDGET_MB, or half of the free memory like the former RLIMIT_AS cap
+    configured = os.environ.get("MEMORY_BUDGET_MB")
+    if configured:
+        return int(configured) * MiB
+    try:
+        return getAvailableMemory() // 2
+    except OSError:
+        return 1024 * MiB
+
+memoryBudget = getBudget()
+throttleAt = float(os.environ.get("MEMORY_THROTTLE_AT", 0.7))  # fraction of the budget
+spillAt = float(os.environ.get("MEMORY_SPILL_AT", 0.8))
+maxInFlight = int(os.environ.get("MAX_IN_FLIGHT_REQUESTS", 50))
+growthTolerance = 0.01  # RSS growth per check, as a fraction of the budget, still counted as flat
+spillDir = os.environ.get("SPILL_DIR", tempfile.gettempdir())
+
+pageSize = os.sysconf("SC_PAGE_SIZE")
+
+def getRSS():
+    # Resident set size of this process in bytes
+    with open('/proc/self/statm', 'r') as statm:
+        return int(statm.read().split()[1]) * pageSize
+
+def memoryPressure():
+    # RSS as a fraction of the budget
+    return getRSS() / memoryBudget
+
+
+class AdaptiveLimiter:
+    # Bounds the in-flight requests of one event loop. The bound is halved while RSS is
+    # above the throttle threshold and still growing, and grows back by one per interval
+    # once RSS stops growing: CPython rarely returns freed memory to the OS, so a flat RSS
+    # above the threshold means freed memory is being reused, not that usage is rising.
+    # It never goes below one so the run keeps making progress.
+    def __init__(self, limit = maxInFlight, interval = 0.5):
+        self.maxLimit = limit
+        self.limit = limit
+        self.inFlight = 0
+        self.interval = interval
+        self.checkedAt = 0
+        self.lastRSS = getRSS()
+        self.released = asyncio.Event()
+
+    def adjust(self):
+        now = time.monotonic()
+        if now - self.checkedAt < self.interval:
+            return
+        self.checkedAt = now
+
+        rss = getRSS()
+        growing = rss - self.lastRSS > memoryBudget * growthTolerance
+        self.lastRSS = rss
+
+        pressure = rss / memoryBudget
+        if pressure >= throttleAt and growing and self.limit > 1:
+            self.limit = max(1, self.limit // 2)
+            logger.info(f"Memory at {pressure:.0%} of budget. Reducing in-flight requests to {self.limit}.")
+        elif (pressure < throttleAt * 0.8 or not growing) and self.limit < self.maxLimit:
+            self.limit += 1
+
+    async def __aenter__(self):
+        # Only used from its own event loop, so no lock is needed around the counters
+        while True:
+            self.adjust()
+            if self.inFlight < self.limit:
+                self.inFlight += 1
+                return self
+            self.released.clear()
+            try:
+                await asyncio.wait_for(self.released.wait(), self.interval)
+            except asyncio.TimeoutError:
+                pass
+
+    async def __aexit__(self, *exc):
+        self.inFlight -= 1
+        self.released.set()
+
+
+class RecordBuffer:
+    # List-like store of normalized records that moves its contents to a JSON lines
+    # file in SPILL_DIR whenever RSS is above the spill threshold. Like SQLiteRecordStore
+    # it keeps the first record of each natural key (Source, AuctionId, TimeTable), as
+    # the collectors of neighbouring phases can return the same auction.
+    checkEvery = 1000
+
+    def __init__(self):
+        self.records = []
+        self.keys = set()
+        self.spillFile = None
+        self.spilled = 0
+        self.lock = threading.Lock()
+
+    def __len__(self):
+        return self.spilled + len(self.records)
+
+    def append(self, record):
+        key = (str(record.get('Source')), str(record.get('AuctionId')), str(record.get('TimeTable')))
+        with self.lock:
+            if key in self.keys:
+                return
+            self.keys.add(key)
+            self.records.append(record)
+            if len(self.records) % self.checkEvery == 0 and memoryPressure() >= spillAt:
+                self.spill()
+
+    def extend(self, records):
+        for record in records:
+            self.append(record)
+
+    def spill(self):
+        # Caller holds the lock
+        if self.spillFile is None:
+            self.spillFile = tempfile.NamedTemporaryFile('w+', dir=spillDir, prefix="records-", suffix=".jsonl")
+            logger.info(f"Memory above {spillAt:.0%} of budget. Spilling records to {self.spillFile.name}.")
+        for record in self.records:
+            self.spillFile.write(json.dumps(record) + "\n")
+        self.spillFile.flush()
+        self.spilled += len(self.records)
+        self.records = []
+
+    def __iter__(self):
+        if self.spillFile is not None:
+            with open(self.spillFile.name, 'r') as file:
+                for line in file:
+                    yield json.loads(line)
+        yield from list(self.records)
+
+    def close(self):
+        if self.spillFile is not None:
+            self.spillFile.close()
+            self.spillFile = None
+        self.records = []
+        self.keys = set()
+        self.spilled = 0
+
+
+def writeJSONArray(fileName, records):
+    # Streams records into a JSON array without building the whole string in memory
+    with open(fileName, 'w') as file:
+        file.write("[")
+        for index, record in enumerate(records):
+            if index:
+                file.write(", ")
+            file.write(json.dumps(record))
+        file.write("]")
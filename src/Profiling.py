@@ -0,0 +1,161 @@
+import os
+import sys
+import json
+import time
+import asyncio
+import cProfile
+import pstats
+import threading
+from collections import Counter
+from contextlib import contextmanager
+
+from logging_config import setup_logging
+logger = setup_logging()
+
+# Opt-in profiling of aggregation runs, enabled per run from /run-main ("profile": true)
+# or for every run with PROFILE_RUNS=1. A profiled run saves to PROFILES_DIR/<run>/:
+#   stacks.folded      sampled stacks of every thread, for flamegraph.pl / speedscope
+#   cpu.prof           cProfile stats of the collector threads, for pstats / snakeviz
+#                      (on Python 3.12+ only one profiler can be active at a time)
+#   tasks.json         asyncio task timeline (coroutine, thread, start, end)
+#   tasks_summary.txt  wall time per coroutine
+# While no run is profiled, currentProfile is None and the hooks below return immediately.
+
+profilingEnabled = os.environ.get("PROFILE_RUNS", "").lower() in ("1", "true", "yes")
+profilesDir = os.environ.get("PROFILES_DIR", "profiles")
+sampleInterval = float(os.environ.get("PROFILE_SAMPLE_INTERVAL", 0.005))  # seconds
+
+currentProfile = None
+
+
+class RunProfile:
+    def __init__(self):
+        self.name = time.strftime('%Y%m%d-%H%M%S')
+        self.dir = os.path.join(profilesDir, self.name)
+        self.started = time.perf_counter()
+        self.lock = threading.Lock()
+        self.stacks = Counter()
+        self.tasks = []
+        self.profilers = []
+        self.stopped = threading.Event()
+        self.sampler = threading.Thread(target=self.sample, name="profile-sampler", daemon=True)
+
+    def sample(self):
+        ownId = threading.get_ident()
+        while not self.stopped.wait(sampleInterval):
+            names = {thread.ident: thread.name for thread in threading.enumerate()}
+            for threadId, frame in sys._current_frames().items():
+                if threadId == ownId:
+                    continue
+                stack = []
+                while frame is not None:
+                    code = frame.f_code
+                    stack.append(f"{code.co_name} ({os.path.basename(code.co_filename)}:{frame.f_lineno})")
+                    frame = frame.f_back
+                stack.append(names.get(threadId, str(threadId)))
+                self.stacks[";".join(reversed(stack))] += 1
+
+    def recordTask(self, name, start, end):
+        with self.lock:
+            self.tasks.append({
+                "coroutine": name,
+                "thread": threading.current_thread().name,
+                "start": round(start - self.started, 6),
+                "end": round(end - self.started, 6),
+            })
+
+    def save(self):
+        os.makedirs(self.dir, exist_ok=True)
+
+        with open(os.path.join(self.dir, "stacks.folded"), 'w') as file:
+            for stack, count in self.stacks.most_common():
+                file.write(f"{stack} {count}\n")
+
+        if self.profilers:
+            stats = pstats.Stats(self.profilers[0])
+            for profiler in self.profilers[1:]:
+                stats.add(profiler)
+            stats.dump_stats(os.path.join(self.dir, "cpu.prof"))
+
+        with open(os.path.join(self.dir, "tasks.json"), 'w') as file:
+            json.dump(sorted(self.tasks, key=lambda task: task["start"]), file)
+
+        summary = {}
+        for task in self.tasks:
+            count, total, longest = summary.get(task["coroutine"], (0, 0, 0))
+            duration = task["end"] - task["start"]
+            summary[task["coroutine"]] = (count + 1, total + duration, max(longest, duration))
+        with open(os.path.join(self.dir, "tasks_summary.txt"), 'w') as file:
+            file.write(f"{'coroutine':<60} {'tasks':>8} {'total (s)':>12} {'mean (s)':>10} {'max (s)':>10}\n")
+            for name, (count, total, longest) in sorted(summary.items(), key=lambda item: -item[1][1]):
+                file.write(f"{name:<60} {count:>8} {total:>12.3f} {total / count:>10.3f} {longest:>10.3f}\n")
+
+
+def startRun(enabled = False):
+    global currentProfile
+    if not (enabled or profilingEnabled):
+        return None
+    currentProfile = RunProfile()
+    currentProfile.sampler.start()
+    logger.info(f"Profiling this run into {currentProfile.dir}.")
+    return currentProfile
+
+
+def stopRun():
+    global currentProfile
+    profile, currentProfile = currentProfile, None
+    if profile is None:
+        return
+    profile.stopped.set()
+    profile.sampler.join()
+    profile.save()
+    logger.info(f"Profile saved to {profile.dir}.")
+
+
+@contextmanager
+def profileThread():
+    # Records a cProfile of the calling thread for the duration of the block
+    profile = currentProfile
+    if profile is None:
+        yield
+        return
+    profiler = cProfile.Profile()
+    try:
+        profiler.enable()
+    except ValueError as e:
+        # Python 3.12+ allows one active profiler per process: the other collector threads
+        # run unprofiled, the stack sampler still covers them
+        logger.info(f"Not profiling {threading.current_thread().name}: {e}.")
+        profiler = None
+    if profiler is None:
+        yield
+        return
+    try:
+        yield
+    finally:
+        profiler.disable()
+        with profile.lock:
+            profile.profilers.append(profiler)
+
+
+def instrumentLoop():
+    # Records the wall time of every task created on the running loop from now on
+    profile = currentProfile
+    if profile is None:
+        return
+
+    def taskFactory(loop, coro, **kwargs):
+        task = asyncio.Task(coro, loop=loop, **kwargs)
+        name = getattr(coro, "__qualname__", repr(coro))
+        start = time.perf_counter()
+        task.add_done_callback(lambda _: profile.recordTask(name, start, time.perf_counter()))
+        return task
+
+    asyncio.get_running_loop().set_task_factory(taskFactory)
+
+
+def listProfiles():
+    try:
+        return {run: sorted(os.listdir(os.path.join(profilesDir, run))) for run in sorted(os.listdir(profilesDir))}
+    except FileNotFoundError:
+        return {}
@@ -0,0 +1,107 @@
+import os
+import json
+import sqlite3
+import tempfile
+import threading
+
+from MemoryBudget import RecordBuffer, spillDir
+from logging_config import setup_logging
+logger = setup_logging()
+
+# Optional SQLite store for the intermediate normalized records of a run, enabled with
+# INTERMEDIATE_STORE=sqlite. Records are written in batched transactions and deduplicated
+# on the auction natural key (Source, AuctionId, TimeTable); the export streams them back
+# in insertion order, so the date range is no longer bounded by RAM.
+intermediateStore = os.environ.get("INTERMEDIATE_STORE", "memory")
+
+
+class SQLiteRecordStore:
+    batchSize = 5000
+
+    def __init__(self, fileName = None):
+        if fileName is None:
+            handle, fileName = tempfile.mkstemp(dir=spillDir, prefix="records-", suffix=".sqlite3")
+            os.close(handle)
+        self.fileName = fileName
+        self.lock = threading.Lock()
+        self.pending = []
+
+        # Shared by the collector threads, every access goes through self.lock
+        self.connection = sqlite3.connect(fileName, check_same_thread=False)
+        self.connection.execute("PRAGMA journal_mode=WAL")
+        self.connection.execute("PRAGMA synchronous=OFF")
+        self.connection.execute("""
+            CREATE TABLE IF NOT EXISTS records (
+                id INTEGER PRIMARY KEY,
+                source TEXT NOT NULL,
+                auction_id TEXT NOT NULL,
+                timetable TEXT NOT NULL,
+                record TEXT NOT NULL
+            )""")
+        self.connection.execute("""
+            CREATE UNIQUE INDEX IF NOT EXISTS records_natural_key
+            ON records (source, auction_id, timetable)""")
+        self.connection.commit()
+
+    def append(self, record):
+        with self.lock:
+            self.pending.append((
+                str(record.get('Source')),
+                str(record.get('AuctionId')),
+                str(record.get('TimeTable')),
+                json.dumps(record),
+            ))
+            if len(self.pending) >= self.batchSize:
+                self.flush()
+
+    def extend(self, records):
+        for record in records:
+            self.append(record)
+
+    def flush(self):
+        # Caller holds the lock. The first record of a natural key wins.
+        if not self.pending:
+            return
+        with self.connection:
+            self.connection.executemany(
+                "INSERT OR IGNORE INTO records (source, auction_id, timetable, record) VALUES (?, ?, ?, ?)",
+                self.pending)
+        self.pending = []
+
+    def __len__(self):
+        with self.lock:
+            self.flush()
+            return self.connection.execute("SELECT COUNT(*) FROM records").fetchone()[0]
+
+    def __iter__(self):
+        with self.lock:
+            self.flush()
+        lastId = 0
+        while True:
+            with self.lock:
+                rows = self.connection.execute(
+                    "SELECT id, record FROM records WHERE id > ? ORDER BY id LIMIT ?",
+                    (lastId, self.batchSize)).fetchall()
+            if not rows:
+                return
+            for rowId, record in rows:
+                yield json.loads(record)
+            lastId = rows[-1][0]
+
+    def close(self):
+        with self.lock:
+            self.pending = []
+            self.connection.close()
+        for suffix in ("", "-wal", "-shm"):
+            try:
+                os.remove(self.fileName + suffix)
+            except FileNotFoundError:
+                pass
+
+
+def newRecordStore():
+    if intermediateStore == "sqlite":
+        store = SQLiteRecordStore()
+        logger.info(f"Storing intermediate records in {store.fileName}.")
+        return store
+    return RecordBuffer()
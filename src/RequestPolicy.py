@@ -0,0 +1,149 @@
+import os
+import time
+import random
+import asyncio
+import threading
+from collections import deque
+
+import aiohttp
+
+from logging_config import setup_logging
+logger = setup_logging()
+
+# Time limits shared by every upstream request of an aggregation run.
+# A run gets a Deadline (RUN_DEADLINE seconds) that is passed down to the collectors:
+# their gathers are cancelled once it passes and the unfinished units become journal
+# gaps for the next run. Each request also has connect and read timeouts, and retries
+# back off exponentially within what is left of the deadline.
+# Requests to endpoints with a LatencyTracker are hedged: when one has not answered
+# after the HEDGE_PERCENTILE latency of that endpoint, a duplicate is sent and the
+# first response wins.
+
+runDeadline = float(os.environ.get("RUN_DEADLINE", 3 * 3600))  # seconds
+connectTimeout = float(os.environ.get("REQUEST_CONNECT_TIMEOUT", 10))
+readTimeout = float(os.environ.get("REQUEST_READ_TIMEOUT", 60))
+retryDelay = float(os.environ.get("REQUEST_RETRY_DELAY", 1))  # doubled on every attempt
+hedgePercentile = float(os.environ.get("HEDGE_PERCENTILE", 0.95))
+hedgeMinSamples = 20  # latencies needed before hedging starts
+
+
+class DeadlineExceeded(Exception):
+    pass
+
+
+class Deadline:
+    def __init__(self, seconds = runDeadline):
+        self.seconds = seconds
+        self.at = time.monotonic() + seconds
+
+    def remaining(self):
+        return max(0.0, self.at - time.monotonic())
+
+    @property
+    def expired(self):
+        return time.monotonic() >= self.at
+
+    def check(self):
+        if self.expired:
+            raise DeadlineExceeded(f"Run deadline of {self.seconds:g}sec reached")
+
+    def clientTimeout(self):
+        # For aiohttp sessions; the run as a whole is bounded by run()
+        return aiohttp.ClientTimeout(total=None, sock_connect=connectTimeout, sock_read=readTimeout)
+
+    def requestsTimeout(self):
+        # (connect, read) for the requests library
+        self.check()
+        remaining = self.remaining()
+        return (min(connectTimeout, remaining), min(readTimeout, remaining))
+
+    async def run(self, awaitable):
+        # Awaits within the deadline, cancelling the awaitable when it passes
+        self.check()
+        try:
+            return await asyncio.wait_for(awaitable, self.remaining())
+        except asyncio.TimeoutError:
+            raise DeadlineExceeded(f"Run deadline of {self.seconds:g}sec reached")
+
+    def backoffDelay(self, attempt):
+        # Delay before retry number attempt + 1, with jitter so retries do not arrive together
+        delay = retryDelay * 2 ** (attempt - 1) * random.uniform(0.5, 1)
+        if delay >= self.remaining():
+            raise DeadlineExceeded(f"Run deadline of {self.seconds:g}sec reached")
+        return delay
+
+    async def backoff(self, attempt):
+        await asyncio.sleep(self.backoffDelay(attempt))
+
+    def backoffSync(self, attempt):
+        # backoff() for requests sent outside of an event loop
+        time.sleep(self.backoffDelay(attempt))
+
+
+class LatencyTracker:
+    # Recent latencies of one endpoint, shared by the collector threads
+    def __init__(self, name, size = 500):
+        self.name = name
+        self.latencies = deque(maxlen=size)
+        self.lock = threading.Lock()
+        self.hedges = 0
+        self.hedgeWins = 0
+
+    def record(self, seconds):
+        with self.lock:
+            self.latencies.append(seconds)
+
+    def threshold(self):
+        with self.lock:
+            if len(self.latencies) < hedgeMinSamples:
+                return None
+            ordered = sorted(self.latencies)
+        return ordered[min(len(ordered) - 1, int(len(ordered) * hedgePercentile))]
+
+    def countHedge(self, won):
+        with self.lock:
+            self.hedges += 1
+            self.hedgeWins += won
+
+    def report(self):
+        with self.lock:
+            hedges, wins = self.hedges, self.hedgeWins
+            self.hedges = self.hedgeWins = 0
+        if hedges:
+            logger.info(f"Hedged {hedges} slow {self.name} requests, {wins} answered first by the duplicate.")
+
+
+async def hedged(request, tracker):
+    # Runs request(), a coroutine function for one attempt, and a duplicate once the first
+    # is slower than the tracker's threshold. Returns the first successful result and
+    # cancels the other; raises if both fail.
+    start = time.monotonic()
+    first = asyncio.ensure_future(request())
+    pending = {first}
+    hedge = None
+
+    try:
+        threshold = tracker.threshold()
+        if threshold is not None:
+            done, pending = await asyncio.wait(pending, timeout=threshold)
+            if not done:
+                hedge = asyncio.ensure_future(request())
+                pending.add(hedge)
+            else:
+                pending = done
+
+        error = None
+        while pending:
+            done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+            for task in done:
+                if task.exception() is None:
+                    tracker.record(time.monotonic() - start)
+                    if hedge is not None:
+                        tracker.countHedge(task is hedge)
+                    return task.result()
+                error = task.exception()
+        raise error
+    finally:
+        for task in (first, hedge):
+            if task is not None and not task.done():
+                task.cancel()
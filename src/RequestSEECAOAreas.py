@@ -1,8 +1,9 @@
 import requests
+from RequestPolicy import connectTimeout, readTimeout
 from logging_config import setup_logging
 logger = setup_logging()
 
-def getAreas():
+def getAreas(timeout = (connectTimeout, readTimeout)):
     url = "https://api.seecao.com/api/config"
 
     headers = {
@@ -22,7 +23,7 @@ def getAreas():
     }
 
     
-    response = requests.request("GET", url, headers=headers)
+    response = requests.request("GET", url, headers=headers, timeout=timeout)
 
     # Check if the response status code is 400 (Bad Request)
     if response.status_code == 400:
@@ -1,39 +1,112 @@
-import requests
 import json
+import time
+import codecs
 
-def getAuctions(fromDate, toDate, borderIds, horizon):
-    url = "https://api.seecao.com/api/data/filter_export"
+import RunMetrics
 
+url = "https://api.seecao.com/api/data/filter_export"
+
+headers = {
+'Accept': 'application/json, text/plain, */*',
+'Accept-Language': 'en-US,en;q=0.9',
+'Authorization': 'Bearer false',
+'Connection': 'keep-alive',
+'Content-Type': 'application/json',
+'Origin': 'https://seecao.com',
+'Referer': 'https://seecao.com/export/',
+'Sec-Fetch-Dest': 'empty',
+'Sec-Fetch-Mode': 'cors',
+'Sec-Fetch-Site': 'same-site',
+'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/123.0.0.0 Safari/537.36',
+'sec-ch-ua': '"Google Chrome";v="123", "Not:A-Brand";v="8", "Chromium";v="123"',
+'sec-ch-ua-mobile': '?0',
+'sec-ch-ua-platform': '"Windows"'
+}
+
+
+class ArrayStreamParser:
+    # Incrementally parses the elements of the array under `key` in a streamed JSON
+    # object, e.g. {"auctions": [{...}, {...}]}, yielding each element once it is complete
+    def __init__(self, key):
+        self.marker = f'"{key}"'
+        self.decoder = json.JSONDecoder()
+        self.textDecoder = codecs.getincrementaldecoder('utf-8')()
+        self.buffer = ""
+        self.position = 0
+        self.inArray = False
+        self.done = False
+
+    def feed(self, chunk):
+        self.buffer += self.textDecoder.decode(chunk)
+        elements = []
+
+        if not self.inArray:
+            markerAt = self.buffer.find(self.marker)
+            if markerAt == -1:
+                return elements
+            value = self.buffer[markerAt + len(self.marker):].lstrip(" \t\r\n:")
+            if not value:
+                return elements
+            if value[0] != "[":
+                # null or an empty value: no elements
+                self.inArray = self.done = True
+                return elements
+            self.inArray = True
+            self.position = len(self.buffer) - len(value) + 1
+
+        while not self.done:
+            # Skip separators between elements
+            while self.position < len(self.buffer) and self.buffer[self.position] in " \t\r\n,":
+                self.position += 1
+            if self.position >= len(self.buffer):
+                break
+            if self.buffer[self.position] == "]":
+                self.done = True
+                break
+            try:
+                element, end = self.decoder.raw_decode(self.buffer, self.position)
+            except json.JSONDecodeError:
+                # Incomplete element, wait for the next chunk
+                break
+            if end >= len(self.buffer):
+                # A scalar cut at the end of the chunk could look complete
+                break
+            elements.append(element)
+            self.position = end
+
+        # Drop what has been parsed so the buffer only holds the current element
+        self.buffer = self.buffer[self.position:]
+        self.position = 0
+        return elements
+
+    def close(self):
+        if not self.done:
+            if not self.inArray:
+                raise Exception(f"SEECAO: {self.marker} not found in the response")
+            raise Exception("SEECAO: Response ended before the end of the auction list")
+
+
+async def streamAuctions(session, fromDate, toDate, borderIds, horizon):
+    # Async generator over the auctions of one filter_export request, parsed as the body streams in
     payload = json.dumps({
     "type": horizon,
     "borders": borderIds,
     "dayFrom": fromDate,
     "dayTo": toDate
     })
-    
-    headers = {
-    'Accept': 'application/json, text/plain, */*',
-    'Accept-Language': 'en-US,en;q=0.9',
-    'Authorization': 'Bearer false',
-    'Connection': 'keep-alive',
-    'Content-Type': 'application/json',
-    'Origin': 'https://seecao.com',
-    'Referer': 'https://seecao.com/export/',
-    'Sec-Fetch-Dest': 'empty',
-    'Sec-Fetch-Mode': 'cors',
-    'Sec-Fetch-Site': 'same-site',
-    'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/123.0.0.0 Safari/537.36',
-    'sec-ch-ua': '"Google Chrome";v="123", "Not:A-Brand";v="8", "Chromium";v="123"',
-    'sec-ch-ua-mobile': '?0',
-    'sec-ch-ua-platform': '"Windows"'
-    }
-
-    response = requests.request("POST", url, headers=headers, data=payload)
-
-    if response.status_code == 400:
-        raise Exception("SEECAO: Bad request")
-    elif response.status_code == 200:
-        return response.text
-    else:
-        raise Exception(f"Unexpected status code: {response.status_code}")
-    
\ No newline at end of file
+
+    started = time.monotonic()
+    size = 0
+    async with session.post(url, headers=headers, data=payload) as response:
+        if response.status == 400:
+            raise Exception("SEECAO: Bad request")
+        elif response.status != 200:
+            raise Exception(f"Unexpected status code: {response.status}")
+
+        parser = ArrayStreamParser("auctions")
+        async for chunk in response.content.iter_chunked(64 * 1024):
+            size += len(chunk)
+            for auction in parser.feed(chunk):
+                yield auction
+        parser.close()
+    RunMetrics.observe("SEECAO export", time.monotonic() - started, size)
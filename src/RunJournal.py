@@ -0,0 +1,90 @@
+import os
+import json
+import time
+import threading
+
+from logging_config import setup_logging
+logger = setup_logging()
+
+# On-disk journal of the completed units of work (one upstream response each) of an
+# aggregation run. A run that ends with gaps leaves its journal behind, and the next
+# run over the same range resumes from it, refetching only the missing units.
+journalDir = os.environ.get("RUN_JOURNAL_DIR", "journal")
+journalTTL = int(os.environ.get("RUN_JOURNAL_TTL", 2 * 24 * 3600))  # seconds
+
+
+class RunJournal:
+    def __init__(self, start_date, end_date, readOnly = False):
+        # A read-only journal (for planning) leaves the file as it is, a run may be writing to it
+        os.makedirs(journalDir, exist_ok=True)
+        runName = f"{start_date:%Y%m%d%H%M%S}-{end_date:%Y%m%d%H%M%S}"
+        self.fileName = os.path.join(journalDir, f"run-{runName}.jsonl")
+        self.lock = threading.Lock()
+        self.completed = {}  # unit -> offset of its entry in the journal file, responses stay on disk
+        self.gaps = []
+
+        stale = os.path.exists(self.fileName) and time.time() - os.path.getmtime(self.fileName) > journalTTL
+        if stale and not readOnly:
+            logger.info(f"Discarding stale journal {self.fileName}.")
+            os.remove(self.fileName)
+
+        try:
+            if stale and readOnly:
+                # The next run will discard it
+                raise FileNotFoundError(self.fileName)
+            with open(self.fileName, 'rb' if readOnly else 'rb+') as file:
+                offset = 0
+                for line in file:
+                    if not line.endswith(b"\n"):
+                        # The last line is cut short if the previous run was killed
+                        break
+                    try:
+                        entry = json.loads(line)
+                        self.completed[entry["unit"]] = offset
+                    except ValueError:
+                        pass
+                    offset += len(line)
+                if not readOnly:
+                    file.truncate(offset)
+        except FileNotFoundError:
+            pass
+
+        if self.completed and not readOnly:
+            logger.info(f"Resuming from {self.fileName}: {len(self.completed)} units already completed.")
+
+    @property
+    def resumable(self):
+        return bool(self.completed)
+
+    def __contains__(self, unit):
+        return unit in self.completed
+
+    def get(self, unit):
+        offset = self.completed.get(unit)
+        if offset is None:
+            return None
+        with open(self.fileName, 'rb') as file:
+            file.seek(offset)
+            return json.loads(file.readline())["data"]
+
+    def record(self, unit, data):
+        line = (json.dumps({"unit": unit, "data": data}) + "\n").encode()
+        with self.lock:
+            with open(self.fileName, 'ab') as file:
+                offset = file.tell()
+                file.write(line)
+            self.completed[unit] = offset
+
+    def addGap(self, unit, error):
+        logger.warning(f"Unit {unit} failed: {error}")
+        with self.lock:
+            self.gaps.append({"unit": unit, "error": str(error)})
+
+    def clear(self):
+        # Called once a run has completed without gaps
+        with self.lock:
+            self.completed = {}
+            try:
+                os.remove(self.fileName)
+            except FileNotFoundError:
+                pass
@@ -0,0 +1,125 @@
+import os
+import json
+import time
+import threading
+
+from logging_config import setup_logging
+logger = setup_logging()
+
+# Request metrics of aggregation runs, used by RunPlanner to estimate the cost of a run.
+# While a run is measured, the collectors report every upstream request (kind, latency,
+# bytes) and a few counts; the collector threads report their wall time. Finished runs
+# are appended to RUN_METRICS, which keeps the last keptRuns of them.
+
+metricsFileName = os.environ.get("RUN_METRICS", "run_metrics.json")
+keptRuns = 10
+
+# Request kinds, grouped by the collector that sends them
+requestKinds = {
+    "JAO": ("JAO auction",),
+    "SEECAO": ("SEECAO export", "SEECAO specification"),
+}
+
+currentRun = None  # like Profiling.currentProfile
+
+
+class RunMetrics:
+    def __init__(self):
+        self.started = time.time()
+        self.lock = threading.Lock()
+        self.requests = {}  # kind -> {"requests", "bytes", "latency"}
+        self.counts = {}
+        self.wall = {}  # source -> seconds its collectors ran, summed over horizons
+
+    def observe(self, kind, seconds, size):
+        with self.lock:
+            entry = self.requests.setdefault(kind, {"requests": 0, "bytes": 0, "latency": 0.0})
+            entry["requests"] += 1
+            entry["bytes"] += size
+            entry["latency"] += seconds
+
+    def count(self, name, amount):
+        with self.lock:
+            self.counts[name] = self.counts.get(name, 0) + amount
+
+    def addWall(self, source, seconds):
+        with self.lock:
+            self.wall[source] = self.wall.get(source, 0.0) + seconds
+
+    def toDict(self):
+        with self.lock:
+            return {"started": self.started, "requests": self.requests, "counts": self.counts, "wall": self.wall}
+
+
+def startRun():
+    global currentRun
+    currentRun = RunMetrics()
+    return currentRun
+
+
+def finishRun():
+    global currentRun
+    run, currentRun = currentRun, None
+    if run is None or not run.requests:
+        return
+    runs = (loadRuns() + [run.toDict()])[-keptRuns:]
+    tmpFileName = f"{metricsFileName}.tmp"
+    with open(tmpFileName, 'w') as file:
+        json.dump(runs, file)
+    os.replace(tmpFileName, metricsFileName)
+
+
+def observe(kind, seconds, size):
+    run = currentRun
+    if run is not None:
+        run.observe(kind, seconds, size)
+
+
+def count(name, amount = 1):
+    run = currentRun
+    if run is not None:
+        run.count(name, amount)
+
+
+def addWall(source, seconds):
+    run = currentRun
+    if run is not None:
+        run.addWall(source, seconds)
+
+
+def loadRuns():
+    try:
+        with open(metricsFileName, 'r') as file:
+            return json.load(file)
+    except (FileNotFoundError, ValueError):
+        return []
+
+
+def summarize(runs = None):
+    # Per request kind: mean latency and size over the kept runs. Per source: effective
+    # concurrency, the request latency its collectors overlapped per second of wall time.
+    runs = loadRuns() if runs is None else runs
+    totals = {}
+    counts = {}
+    wall = {}
+    for run in runs:
+        for kind, entry in run["requests"].items():
+            total = totals.setdefault(kind, {"requests": 0, "bytes": 0, "latency": 0.0})
+            for field in total:
+                total[field] += entry[field]
+        for name, amount in run["counts"].items():
+            counts[name] = counts.get(name, 0) + amount
+        for source, seconds in run["wall"].items():
+            wall[source] = wall.get(source, 0.0) + seconds
+
+    kinds = {kind: {"latency": total["latency"] / total["requests"], "bytes": total["bytes"] / total["requests"]}
+             for kind, total in totals.items() if total["requests"]}
+
+    concurrency = {}
+    for source, sourceKinds in requestKinds.items():
+        latency = sum(totals.get(kind, {}).get("latency", 0.0) for kind in sourceKinds)
+        if wall.get(source):
+            concurrency[source] = max(1.0, latency / wall[source])
+
+    requests = {kind: total["requests"] for kind, total in totals.items()}
+    return {"runs": len(runs), "kinds": kinds, "requests": requests, "counts": counts, "concurrency": concurrency}
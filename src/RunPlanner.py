@@ -0,0 +1,256 @@
+import os
+from datetime import datetime, timedelta
+
+from GetJAO import getDateRanges, getCorridorsFor, jaoUnit
+from GetSEECAO import getBorderIds, getBorderGroups, getDateWindows, exportUnit, specUnit, areasUnit
+from SEECAOSpecStore import getCachedSpec
+from RunJournal import RunJournal
+from RequestPolicy import Deadline
+import RunMetrics
+
+from logging_config import setup_logging
+logger = setup_logging()
+
+# Work plan of an aggregation run: the range expanded into its work items (one collector
+# call per source, horizon and phase) and their units (one upstream request each), minus
+# the units a previous run left in the journal and the SEECAO specs that are stored.
+# The request count, bytes and duration are estimated from the metrics of past runs
+# (RunMetrics). Planning only sends the corridor and border lookups, which are cached.
+# A work item whose lookup fails carries "failed" and is recorded as a gap by the run,
+# which still collects the rest of the plan.
+#
+#   python RunPlanner.py [start YYYY-MM-DD] [end YYYY-MM-DD] [--details]
+#   POST /plan {"secret", "start_date", "end_date", "details"}
+
+defaultStartDate = datetime(2019, 12, 1, 23, 0, 0)  # December 1, 2019, 23:00:00
+defaultEndDate = datetime(2025, 1, 1, 23, 59, 59)  # January 1, 2025, 23:59:59
+
+horizons = ("Monthly", "Yearly")
+
+# The current and upcoming month and year are collected and published first, as
+# auctions_recent.json, before the older periods are backfilled into auctions.json
+progressivePublish = os.environ.get("PROGRESSIVE_PUBLISH", "1").lower() in ("1", "true", "yes")
+
+
+def monthStart(year, month):
+    # Monthly JAO ranges start on the first of the month at 23:00 (see GetJAO.getDateRanges)
+    year, month = year + (month - 1) // 12, (month - 1) % 12 + 1
+    return datetime(year, month, 1, 23, 0, 0)
+
+def getRecentStart(start_date, end_date, horizon, now = None):
+    # Start of the recent periods of the range, anchored on today or on the end of a past range
+    anchor = min(now or datetime.now(), end_date)
+    if horizon == "Yearly":
+        recentStart = datetime(anchor.year, 1, 1)
+    else:
+        recentStart = monthStart(anchor.year, anchor.month)
+        if recentStart > anchor:
+            recentStart = monthStart(anchor.year, anchor.month - 1)
+    return max(start_date, recentStart)
+
+def getRecentEnd(recentStart, end_date, horizon):
+    # End of the upcoming month or year
+    if horizon == "Yearly":
+        recentEnd = datetime(recentStart.year + 1, 12, 31, 23, 59, 59)
+    else:
+        month = recentStart if recentStart >= monthStart(recentStart.year, recentStart.month) else \
+            monthStart(recentStart.year, recentStart.month - 1)
+        recentEnd = monthStart(month.year, month.month + 2) - timedelta(seconds=1)
+    return min(end_date, recentEnd)
+
+def getPhases(start_date, end_date, horizon, now = None):
+    # [(phase, start, end)] tiling the range: the recent periods first, then the periods
+    # before and after them as backfill
+    if not progressivePublish:
+        return [("full", start_date, end_date)]
+
+    recentStart = getRecentStart(start_date, end_date, horizon, now)
+    recentEnd = getRecentEnd(recentStart, end_date, horizon)
+    phases = [("recent", recentStart, recentEnd)]
+    if recentStart > start_date:
+        phases.append(("backfill", start_date, recentStart - timedelta(seconds=1)))
+    if recentEnd < end_date:
+        phases.append(("backfill", recentEnd + timedelta(seconds=1), end_date))
+    return phases
+
+
+def checkPhases():
+    # The phases of every horizon cover the range exactly, whether today is before, inside or after it
+    start_date, end_date = datetime(2024, 1, 1), datetime(2028, 12, 31, 23, 59, 59)
+    for horizon in horizons:
+        for now in (datetime(2023, 6, 15), datetime(2026, 10, 19), datetime(2026, 10, 1, 12), datetime(2030, 3, 1)):
+            phases = sorted(getPhases(start_date, end_date, horizon, now), key=lambda phase: phase[1])
+            assert phases[0][1] == start_date and phases[-1][2] == end_date, (horizon, now, phases)
+            for (_, _, previousEnd), (_, nextStart, _) in zip(phases, phases[1:]):
+                assert nextStart == previousEnd + timedelta(seconds=1), (horizon, now, phases)
+            assert all(phaseStart <= phaseEnd for _, phaseStart, phaseEnd in phases), (horizon, now, phases)
+    logger.info("Phases tile the range for every horizon.")
+
+
+def estimate(source, requests, metrics):
+    # (bytes, seconds) of the requests of one work item, None where past runs have no metrics
+    kinds = metrics["kinds"]
+    if any(count and kind not in kinds for kind, count in requests.items()):
+        return None, None
+    size = sum(count * kinds[kind]["bytes"] for kind, count in requests.items() if count)
+    latency = sum(count * kinds[kind]["latency"] for kind, count in requests.items() if count)
+    concurrency = metrics["concurrency"].get(source)
+    if not latency:
+        return round(size), 0.0
+    return round(size), (latency / concurrency if concurrency else None)
+
+
+def buildPlan(start_date = None, end_date = None, journal = None, deadline = None, details = False, dryRun = True):
+    start_date = start_date or defaultStartDate
+    end_date = end_date or defaultEndDate
+    if journal is None:
+        journal = RunJournal(start_date, end_date, readOnly=True)
+    if deadline is None:
+        deadline = Deadline()
+    metrics = RunMetrics.summarize()
+
+    # Auctions per filter_export request and the share of specs served by the store, in past runs
+    counts = metrics["counts"]
+    exports = metrics["requests"].get("SEECAO export", 0)
+    auctionsPerExport = counts.get("SEECAO exported auctions", 0) / exports if exports else None
+    storedSpecs = counts.get("SEECAO stored specifications", 0)
+    fetchedSpecs = metrics["requests"].get("SEECAO specification", 0)
+    storedRatio = storedSpecs / (storedSpecs + fetchedSpecs) if storedSpecs + fetchedSpecs else 0.0
+
+    areas = journal.get(areasUnit) if areasUnit in journal else None
+    specs = {"stored": set(), "journaled": set(), "pending": set()}
+    work = []
+
+    def failed(source, horizon, phase, phaseStart, phaseEnd, error):
+        # A work item whose discovery lookup failed: the run records it as a gap
+        return {
+            "source": source, "horizon": horizon, "phase": phase, "start": phaseStart, "end": phaseEnd,
+            "units": 0, "journaled": 0, "pendingUnits": [], "requests": {}, "failed": str(error),
+        }
+
+    for horizon in horizons:
+        try:
+            corridors = getCorridorsFor(horizon, deadline)
+            corridorError = None
+        except Exception as e:
+            logger.warning(f"JAO corridor discovery failed for horizon {horizon}: {e}")
+            corridorError = e
+
+        areasError = None
+        if areas is None:
+            try:
+                areas = getBorderIds(horizon, deadline)
+                if not dryRun:
+                    journal.record(areasUnit, areas)
+            except Exception as e:
+                logger.warning(f"SEECAO border lookup failed for horizon {horizon}: {e}")
+                areasError = e
+
+        for phase, phaseStart, phaseEnd in getPhases(start_date, end_date, horizon):
+            if corridorError is not None:
+                work.append(failed("JAO", horizon, phase, phaseStart, phaseEnd, corridorError))
+            else:
+                units = [jaoUnit(horizon, corridor, date_range)
+                         for corridor in corridors for date_range in getDateRanges(phaseStart, phaseEnd, horizon)]
+                pending = [unit for unit in units if unit not in journal]
+                work.append({
+                    "source": "JAO", "horizon": horizon, "phase": phase, "start": phaseStart, "end": phaseEnd,
+                    "units": len(units), "journaled": len(units) - len(pending), "pendingUnits": pending,
+                    "requests": {"JAO auction": len(pending)},
+                })
+
+            if areasError is not None:
+                work.append(failed("SEECAO", horizon, phase, phaseStart, phaseEnd, areasError))
+                continue
+            units = [exportUnit(horizon, group, fromDate, toDate)
+                     for group in getBorderGroups(areas) for fromDate, toDate in getDateWindows(phaseStart, phaseEnd)]
+            pending = [unit for unit in units if unit not in journal]
+
+            # The spec fan-out is known for exports in the journal and estimated for the others
+            newSpecs = 0
+            for unit in units:
+                if unit in journal:
+                    for auction in journal.get(unit):
+                        auctionID = auction.get("auctionId")
+                        if any(auctionID in known for known in specs.values()):
+                            continue
+                        if getCachedSpec(auctionID) is not None:
+                            specs["stored"].add(auctionID)
+                        elif specUnit(auctionID) in journal:
+                            specs["journaled"].add(auctionID)
+                        else:
+                            specs["pending"].add(auctionID)
+                            newSpecs += 1
+            estimatedSpecs = round(len(pending) * auctionsPerExport * (1 - storedRatio)) if auctionsPerExport is not None else 0
+
+            work.append({
+                "source": "SEECAO", "horizon": horizon, "phase": phase, "start": phaseStart, "end": phaseEnd,
+                "units": len(units), "journaled": len(units) - len(pending), "pendingUnits": pending,
+                "requests": {"SEECAO export": len(pending), "SEECAO specification": newSpecs + estimatedSpecs},
+                "estimatedSpecifications": estimatedSpecs,
+            })
+
+    phases = []
+    for item in work:
+        item["bytes"], item["seconds"] = estimate(item["source"], item["requests"], metrics)
+        if item["phase"] not in phases:
+            phases.append(item["phase"])
+        if not details:
+            del item["pendingUnits"]
+
+    # Work items of a phase run concurrently, the phases one after the other
+    sizes = [item["bytes"] for item in work]
+    durations = []
+    for phase in phases:
+        phaseSeconds = [item["seconds"] for item in work if item["phase"] == phase]
+        durations.append(None if None in phaseSeconds else max(phaseSeconds, default=0))
+
+    return {
+        "start_date": start_date,
+        "end_date": end_date,
+        "phases": phases,
+        "work": work,
+        "specifications": {name: len(auctionIDs) for name, auctionIDs in specs.items()},
+        "estimate": {
+            "requests": sum(sum(item["requests"].values()) for item in work),
+            "bytes": None if None in sizes else sum(sizes),
+            "seconds": None if None in durations else round(sum(durations), 1),
+            "basis": f"metrics of the last {metrics['runs']} runs",
+        },
+    }
+
+
+def logPlan(plan):
+    for item in plan["work"]:
+        if "failed" in item:
+            logger.warning(f"Plan: {item['source']} {item['horizon']} {item['phase']} from {item['start']} to {item['end']}: "
+                           f"discovery failed, recorded as a gap ({item['failed']}).")
+            continue
+        logger.info(f"Plan: {item['source']} {item['horizon']} {item['phase']} from {item['start']} to {item['end']}: "
+                    f"{item['units']} units, {item['journaled']} journaled, {item['requests']} requests.")
+    total = plan["estimate"]
+    size = f"{total['bytes'] / 1024 / 1024:.1f}MB" if total["bytes"] is not None else "unknown size"
+    duration = f"~{total['seconds']:.0f}sec" if total["seconds"] is not None else "unknown duration"
+    logger.info(f"Plan: {total['requests']} requests, {size}, {duration} (estimated from {total['basis']}).")
+
+
+if __name__ == "__main__":
+    import json
+    import argparse
+    from dotenv import load_dotenv
+    load_dotenv()
+
+    parser = argparse.ArgumentParser(description="Plan an aggregation run without running it.")
+    parser.add_argument("start_date", nargs="?", type=lambda value: datetime.strptime(value, "%Y-%m-%d"))
+    parser.add_argument("end_date", nargs="?", type=lambda value: datetime.strptime(value, "%Y-%m-%d"))
+    parser.add_argument("--details", action="store_true", help="list the pending units of every work item")
+    parser.add_argument("--check", action="store_true", help="check that the phases tile the range, then exit")
+    arguments = parser.parse_args()
+
+    if arguments.check:
+        checkPhases()
+        raise SystemExit
+
+    plan = buildPlan(arguments.start_date, arguments.end_date, details=arguments.details)
+    logPlan(plan)
+    print(json.dumps(plan, indent=4, default=str))
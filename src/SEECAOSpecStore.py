@@ -0,0 +1,111 @@
+import os
+import json
+import time
+import threading
+from datetime import datetime, timedelta, timezone
+
+from StorageBackend import getBackend
+from logging_config import setup_logging
+logger = setup_logging()
+
+# Persistent store of SEECAO auction specifications, keyed by auctionIdentification.
+# Specs of auctions whose delivery period has ended are final and served locally;
+# everything else is fetched again from api.seecao.com.
+# The container's disk does not survive restarts, so the store is also published
+# through the storage backend after each run, under the base name of the file, and
+# read back from it when the local file is missing.
+specStoreFileName = os.environ.get("SEECAO_SPEC_STORE", "seecao_specs.json")
+
+# Maintenance periods may still be amended shortly after delivery ends
+finalAfter = timedelta(days=1)
+
+specs = None  # auctionIdentification -> {"final": bool, "fetched_at": float, "data": dict}
+changed = False  # specs were stored since the store was last published
+storeLock = threading.Lock()
+
+
+def parsePeriod(value):
+    # SEECAO periods are ISO 8601 strings, with or without a time part
+    if not value:
+        return None
+    try:
+        parsed = datetime.fromisoformat(str(value).replace("Z", "+00:00"))
+    except ValueError:
+        return None
+    if parsed.tzinfo is None:
+        parsed = parsed.replace(tzinfo=timezone.utc)
+    return parsed
+
+
+def isFinal(auction):
+    periodEnd = parsePeriod(auction.get("deliveryPeriodEnd"))
+    if periodEnd is None:
+        return False
+    return periodEnd + finalAfter < datetime.now(timezone.utc)
+
+
+def loadSpecs():
+    global specs
+    with storeLock:
+        if specs is None:
+            try:
+                with open(specStoreFileName, 'r') as file:
+                    specs = json.load(file)
+                logger.info(f"Loaded {len(specs)} SEECAO auction specifications from {specStoreFileName}.")
+            except (FileNotFoundError, ValueError):
+                specs = downloadSpecs()
+        return specs
+
+
+def downloadSpecs():
+    # The published store, or an empty one. Caller holds storeLock.
+    try:
+        content = getBackend().get(os.path.basename(specStoreFileName))
+        if content:
+            published = json.loads(content)
+            logger.info(f"Loaded {len(published)} SEECAO auction specifications from the storage backend.")
+            return published
+    except Exception as e:
+        logger.warning(f"Failed to load the published SEECAO specifications: {e}")
+    return {}
+
+
+def getCachedSpec(auctionID):
+    # Returns the stored spec response if it is final, None if it has to be fetched
+    entry = loadSpecs().get(auctionID)
+    if entry and entry.get("final"):
+        return entry["data"]
+    return None
+
+
+def storeSpec(auctionID, data, final):
+    global changed
+    loadSpecs()
+    with storeLock:
+        specs[auctionID] = {"final": final, "fetched_at": time.time(), "data": data}
+        changed = True
+
+
+def saveSpecs():
+    if specs is None:
+        return
+    with storeLock:
+        # Write to a temporary file first so an interrupted save never corrupts the store
+        tempFileName = f"{specStoreFileName}.{threading.get_ident()}.tmp"
+        with open(tempFileName, 'w') as file:
+            json.dump(specs, file)
+        os.replace(tempFileName, specStoreFileName)
+
+
+def publishSpecs():
+    # Publishes the store if specs were stored since it was last published. A failed
+    # publish only costs refetches after a restart, so it does not fail the run.
+    global changed
+    if not changed:
+        return
+    saveSpecs()
+    try:
+        getBackend().put([specStoreFileName])
+        changed = False
+    except Exception as e:
+        logger.warning(f"Failed to publish the SEECAO specifications: {e}")
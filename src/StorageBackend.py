@@ -0,0 +1,167 @@
+import os
+import mmap
+import uuid
+import shutil
+from datetime import datetime, timezone
+
+from logging_config import setup_logging
+logger = setup_logging()
+
+# Where the aggregator publishes its artifacts, selected with STORAGE_BACKEND:
+#   supabase  the capmap-storage bucket (supaConnect.SupabaseBackend), the default
+#   local     a directory (LOCAL_STORAGE_DIR), for offline runs and single-node deployments;
+#             server.py then serves the published files from it at /storage/<name>?secret=
+# A backend implements:
+#   list()          [{"name", "size", "updated_at"}] with updated_at an aware UTC datetime
+#   stat(name)      one such entry, or None if the file is not published
+#   put(fileNames)  publishes these local files under their base names, replacing existing ones
+#   get(name)       the published bytes, or None
+#   delete(names)   unpublishes these files, missing ones are ignored
+
+storageBackend = os.environ.get("STORAGE_BACKEND", "supabase")
+localStorageDir = os.environ.get("LOCAL_STORAGE_DIR", "local_storage")
+
+readBlockSize = 1024 * 1024
+
+
+class LocalBackend:
+    def __init__(self, root = localStorageDir):
+        self.root = root
+        os.makedirs(root, exist_ok=True)
+
+    def path(self, name):
+        # Published names are flat file names
+        if not name or name != os.path.basename(name) or name.startswith("."):
+            raise ValueError(f"Invalid file name {name}")
+        return os.path.join(self.root, name)
+
+    def entry(self, name, stat):
+        return {
+            "name": name,
+            "size": stat.st_size,
+            "updated_at": datetime.fromtimestamp(stat.st_mtime, timezone.utc),
+        }
+
+    def list(self):
+        with os.scandir(self.root) as entries:
+            return [self.entry(item.name, item.stat()) for item in entries
+                    if item.is_file() and not item.name.startswith(".")]
+
+    def stat(self, name):
+        try:
+            return self.entry(name, os.stat(self.path(name)))
+        except FileNotFoundError:
+            return None
+
+    def put(self, fileNames):
+        # Each file is copied next to its destination and renamed over it, so readers
+        # see either the previous or the new version
+        for fileName in fileNames:
+            name = os.path.basename(fileName)
+            tmpPath = os.path.join(self.root, f".{name}.{uuid.uuid4().hex}.tmp")
+            try:
+                with open(fileName, 'rb') as source, open(tmpPath, 'wb') as target:
+                    shutil.copyfileobj(source, target, readBlockSize)
+                    target.flush()
+                    os.fsync(target.fileno())
+                os.replace(tmpPath, self.path(name))
+            except BaseException:
+                if os.path.exists(tmpPath):
+                    os.remove(tmpPath)
+                raise
+            logger.info(f"Published {name} to {self.root}.")
+
+    def delete(self, names):
+        for name in names:
+            try:
+                os.remove(self.path(name))
+            except FileNotFoundError:
+                pass
+
+    def get(self, name):
+        with self.openMapped(name) as mapped:
+            return None if mapped is None else bytes(mapped)
+
+    def openMapped(self, name):
+        # Read-only map of the published file (None if missing), for use in a with block.
+        # The map keeps the version that was current when it was opened.
+        return MappedFile(self.path(name))
+
+    def readMapped(self, name):
+        # Yields the file in blocks from a memory map, for streaming responses
+        with self.openMapped(name) as mapped:
+            if mapped is None:
+                return
+            for offset in range(0, len(mapped), readBlockSize):
+                yield mapped[offset:offset + readBlockSize]
+
+
+class MappedFile:
+    def __init__(self, path):
+        self.path = path
+        self.mapped = None
+
+    def __enter__(self):
+        try:
+            with open(self.path, 'rb') as file:
+                if os.fstat(file.fileno()).st_size == 0:
+                    # Empty files cannot be mapped
+                    return b""
+                self.mapped = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+        except FileNotFoundError:
+            return None
+        return self.mapped
+
+    def __exit__(self, *exc):
+        if self.mapped is not None:
+            self.mapped.close()
+
+
+backend = None
+
+def getBackend():
+    global backend
+    if backend is None:
+        if storageBackend == "local":
+            backend = LocalBackend()
+            logger.info(f"Publishing to {os.path.abspath(backend.root)}.")
+        else:
+            from supaConnect import SupabaseBackend
+            backend = SupabaseBackend()
+    return backend
+
+
+if __name__ == "__main__":
+    import time
+    import tempfile
+    from LocalStorageServer import writeSampleAuctions
+
+    # Benchmark: publish and read back an auctions.json sized artifact with the local backend
+    workDir = tempfile.mkdtemp(prefix="storage-backend-")
+    local = LocalBackend(os.path.join(workDir, "published"))
+    fileName = os.path.join(workDir, "auctions.json")
+
+    writeSampleAuctions(fileName, 70)
+    size = os.path.getsize(fileName) / 1024 / 1024
+
+    start = time.perf_counter()
+    local.put([fileName])
+    logger.info(f"put: {size:.1f}MB in {time.perf_counter() - start:.3f}sec.")
+
+    start = time.perf_counter()
+    for _ in range(10):
+        local.get("auctions.json")
+    logger.info(f"get: {10 * size / (time.perf_counter() - start):,.0f}MB/sec.")
+
+    start = time.perf_counter()
+    for _ in range(10):
+        for block in local.readMapped("auctions.json"):
+            pass
+    logger.info(f"readMapped: {10 * size / (time.perf_counter() - start):,.0f}MB/sec.")
+
+    start = time.perf_counter()
+    for _ in range(1000):
+        local.stat("auctions.json")
+    logger.info(f"stat: {(time.perf_counter() - start) * 1000:.3f}µs per call.")
+
+    shutil.rmtree(workDir)
@@ -0,0 +1,222 @@
+import os
+import json
+import time
+import base64
+import asyncio
+import threading
+from urllib.parse import urljoin, quote
+
+import aiohttp
+
+from logging_config import setup_logging
+logger = setup_logging()
+
+# Concurrent uploads to Supabase Storage (or LocalStorageServer for tests and benchmarks).
+# Files below the threshold are sent in one request; larger ones use the storage's TUS
+# endpoint, one chunk per PATCH, so a failed chunk is retried from the offset the server
+# acknowledged instead of resending the whole file. The upload URL of an unfinished
+# upload is kept in uploadStateFileName, so the next run resumes it as well.
+
+chunkSize = int(os.environ.get("UPLOAD_CHUNK_SIZE", 6 * 1024 * 1024))  # Supabase expects 6MB chunks
+resumableThreshold = int(os.environ.get("UPLOAD_RESUMABLE_THRESHOLD", 6 * 1024 * 1024))
+uploadConcurrency = int(os.environ.get("UPLOAD_CONCURRENCY", 4))
+uploadRetries = int(os.environ.get("UPLOAD_RETRIES", 5))
+retryDelay = float(os.environ.get("UPLOAD_RETRY_DELAY", 1))  # seconds, doubled on every attempt
+uploadStateFileName = os.environ.get("UPLOAD_STATE", "upload_state.json")
+
+timeout = aiohttp.ClientTimeout(sock_connect=10, sock_read=60)
+stateLock = threading.Lock()
+
+
+def loadState():
+    try:
+        with open(uploadStateFileName, 'r') as file:
+            return json.load(file)
+    except (FileNotFoundError, ValueError):
+        return {}
+
+
+def saveUploadUrl(key, location):
+    # location None forgets the upload
+    with stateLock:
+        state = loadState()
+        if location is None:
+            state.pop(key, None)
+        else:
+            state[key] = location
+        tmpFileName = f"{uploadStateFileName}.tmp"
+        with open(tmpFileName, 'w') as file:
+            json.dump(state, file)
+        os.replace(tmpFileName, uploadStateFileName)
+
+
+def uploadKey(bucket, fileName):
+    # An upload can only be resumed for the same content
+    stat = os.stat(fileName)
+    return f"{bucket}/{fileName}|{stat.st_size}|{stat.st_mtime_ns}"
+
+
+def encodeMetadata(metadata):
+    return ",".join(f"{key} {base64.b64encode(value.encode()).decode()}" for key, value in metadata.items())
+
+
+async def withRetries(description, request):
+    for attempt in range(1, uploadRetries + 1):
+        try:
+            return await request()
+        except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+            if attempt == uploadRetries:
+                raise Exception(f"{description} failed after {uploadRetries} attempts: {e}")
+            backoff = min(retryDelay * 2 ** (attempt - 1), 30)
+            logger.info(f"{description} failed: {e}. Attempt {attempt} of {uploadRetries}. Retrying in {backoff:g} seconds...")
+            await asyncio.sleep(backoff)
+
+
+class StorageUploader:
+    def __init__(self, storageUrl, bucket, headers):
+        # storageUrl is e.g. https://<project>.supabase.co/storage/v1
+        self.storageUrl = storageUrl.rstrip("/")
+        self.bucket = bucket
+        self.headers = headers
+
+    async def uploadFiles(self, files):
+        # files: {fileName: upsert}, published under their base names. Returns the number of bytes sent per file.
+        limiter = asyncio.Semaphore(uploadConcurrency)
+
+        async def upload(session, fileName, upsert):
+            async with limiter:
+                return await self.uploadFile(session, fileName, upsert)
+
+        async with aiohttp.ClientSession(timeout=timeout, headers=self.headers) as session:
+            results = await asyncio.gather(*(upload(session, fileName, upsert) for fileName, upsert in files.items()),
+                                           return_exceptions=True)
+
+        failed = {fileName: result for fileName, result in zip(files, results) if isinstance(result, Exception)}
+        if failed:
+            raise Exception(f"Failed to upload {', '.join(failed)}: {list(failed.values())[0]}")
+        return dict(zip(files, results))
+
+    async def uploadFile(self, session, fileName, upsert):
+        size = os.path.getsize(fileName)
+        start = time.perf_counter()
+        if size < resumableThreshold:
+            await self.uploadSingle(session, fileName, upsert)
+        else:
+            await self.uploadResumable(session, fileName, size, upsert)
+        logger.info(f"Uploaded {fileName} ({size / 1024 / 1024:.2f}MB) in {time.perf_counter() - start:.2f}sec.")
+        return size
+
+    async def uploadSingle(self, session, fileName, upsert):
+        url = f"{self.storageUrl}/object/{self.bucket}/{quote(os.path.basename(fileName))}"
+        headers = {"cache-control": "max-age=3600", "x-upsert": "true" if upsert else "false",
+                   "content-type": "application/json"}
+        with open(fileName, 'rb') as file:
+            body = file.read()
+
+        async def request():
+            async with session.post(url, data=body, headers=headers) as response:
+                if response.status >= 500:
+                    raise aiohttp.ClientResponseError(response.request_info, (), status=response.status,
+                                                      message=await response.text())
+                if response.status not in (200, 201):
+                    raise Exception(f"Upload of {fileName} rejected ({response.status}): {await response.text()}")
+
+        await withRetries(f"Upload of {fileName}", request)
+
+    async def uploadResumable(self, session, fileName, size, upsert):
+        key = uploadKey(self.bucket, fileName)
+        location = loadState().get(key)
+        offset = None
+
+        if location is not None:
+            offset = await self.getOffset(session, location)
+            if offset is None:
+                location = None
+            else:
+                logger.info(f"Resuming the upload of {fileName} at {offset / 1024 / 1024:.2f}MB.")
+
+        if location is None:
+            location = await self.createUpload(session, fileName, size, upsert)
+            saveUploadUrl(key, location)
+            offset = 0
+
+        with open(fileName, 'rb') as file:
+            while offset < size:
+                file.seek(offset)
+                chunk = file.read(chunkSize)
+                offset = await self.sendChunk(session, fileName, location, offset, chunk)
+
+        saveUploadUrl(key, None)
+
+    async def createUpload(self, session, fileName, size, upsert):
+        headers = {
+            "Tus-Resumable": "1.0.0",
+            "Upload-Length": str(size),
+            "Upload-Metadata": encodeMetadata({
+                "bucketName": self.bucket,
+                "objectName": os.path.basename(fileName),
+                "contentType": "application/json",
+                "cacheControl": "3600",
+            }),
+            "x-upsert": "true" if upsert else "false",
+        }
+        endpoint = f"{self.storageUrl}/upload/resumable"
+
+        async def request():
+            async with session.post(endpoint, headers=headers) as response:
+                if response.status >= 500:
+                    raise aiohttp.ClientResponseError(response.request_info, (), status=response.status,
+                                                      message=await response.text())
+                if response.status != 201:
+                    raise Exception(f"Upload of {fileName} rejected ({response.status}): {await response.text()}")
+                return urljoin(endpoint + "/", response.headers["Location"])
+
+        return await withRetries(f"Creating the upload of {fileName}", request)
+
+    async def getOffset(self, session, location):
+        # Offset acknowledged by the server, or None if the upload expired
+        async def request():
+            async with session.head(location, headers={"Tus-Resumable": "1.0.0"}) as response:
+                if response.status in (404, 410):
+                    return None
+                if response.status >= 500:
+                    raise aiohttp.ClientResponseError(response.request_info, (), status=response.status)
+                if response.status != 200:
+                    return None
+                return int(response.headers["Upload-Offset"])
+
+        return await withRetries("Resuming an upload", request)
+
+    async def sendChunk(self, session, fileName, location, offset, chunk):
+        # Returns the new offset. After a failure the offset is read back from the server,
+        # which may have stored part of the chunk.
+        headers = {
+            "Tus-Resumable": "1.0.0",
+            "Upload-Offset": str(offset),
+            "Content-Type": "application/offset+octet-stream",
+        }
+        for attempt in range(1, uploadRetries + 1):
+            try:
+                async with session.patch(location, data=chunk, headers=headers) as response:
+                    if response.status == 204:
+                        return int(response.headers["Upload-Offset"])
+                    if response.status < 500 and response.status != 409:
+                        raise Exception(f"Chunk of {fileName} at {offset} rejected ({response.status}): {await response.text()}")
+                    error = f"status {response.status}"
+            except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+                error = e
+
+            if attempt == uploadRetries:
+                break
+            backoff = min(retryDelay * 2 ** (attempt - 1), 30)
+            logger.info(f"Chunk of {fileName} at {offset} failed: {error}. Attempt {attempt} of {uploadRetries}. Retrying in {backoff:g} seconds...")
+            await asyncio.sleep(backoff)
+
+            acknowledged = await self.getOffset(session, location)
+            if acknowledged is None:
+                raise Exception(f"The upload of {fileName} expired.")
+            if acknowledged != offset:
+                # The server kept part or all of the chunk, continue from there
+                return acknowledged
+
+        raise Exception(f"Chunk of {fileName} at {offset} failed after {uploadRetries} attempts: {error}")
@@ -1,6 +1,3 @@
-from dotenv import load_dotenv
-load_dotenv()
-
 import os
 import json
 import time
@@ -11,24 +8,54 @@ from datetime import datetime
 
 from GetJAO import getJao
 from GetSEECAO import getSEECAO
-from supaConnect import uploadToSupa, checkRemoteFileDate
+from supaConnect import uploadToSupa, checkRemoteFileDate, downloadFromSupa
+from Changelog import buildChangelog, discardChangelog
+from SEECAOSpecStore import publishSpecs
+from BorderIndex import writeBorderView
+import Profiling
+from AuctionSchema import reportInvalidValues
+from RunJournal import RunJournal
+from MemoryBudget import writeJSONArray, memoryBudget, getRSS, MiB
+from RecordStore import newRecordStore
+from StorageBackend import getBackend
+from RequestPolicy import Deadline
+from RunPlanner import buildPlan, logPlan, defaultStartDate, defaultEndDate
+import RunMetrics
 
-import logging
-logger = logging.getLogger("my_fastapi_app")
-logger.setLevel(logging.INFO)
+from logging_config import setup_logging
+logger = setup_logging()
 
 
 # Global flag and lock to ensure thread-safety
 is_main_running = False
 main_lock = threading.Lock()
 
-def main(start_date = datetime, end_date = datetime):
+recentFileName = "auctions_recent.json"
+recentRangeFileName = "auctions_recent_range.json"
+
+def publishRecent(records, runStart):
+    # Publishes the records collected so far as a partial snapshot. auctions.json keeps
+    # the previous full dataset until the backfill is done.
+    if not records:
+        logger.info("No recent auctions collected.")
+        return
+
+    writeJSONArray(recentFileName, records)
+    with open(recentRangeFileName, "w") as json_file:
+        json.dump({"published": datetime.now(), "records": len(records)}, json_file, indent=4, default=str)
+
+    try:
+        getBackend().put([recentFileName, recentRangeFileName])
+        logger.info(f"Published {len(records)} recent auctions {time.perf_counter() - runStart:.2f}sec into the run.")
+    except Exception as e:
+        # The full publish at the end of the run still carries them
+        logger.warning(f"Failed to publish the recent auctions: {e}")
+
+def main(start_date = datetime, end_date = datetime, profile = False):
     if not start_date:
-        # December 1, 2019, 23:00:00
-        start_date = datetime(2019, 12, 1, 23, 0, 0)
+        start_date = defaultStartDate
     if not end_date:
-         # January 1, 2025, 23:59:59
-        end_date = datetime(2025, 1, 1, 23, 59, 59)
+        end_date = defaultEndDate
     
     global is_main_running
     with main_lock:  # Ensure thread-safety
@@ -36,94 +63,152 @@ def main(start_date = datetime, end_date = datetime):
             logger.info("Skipping main; already running.")
             return
         is_main_running = True
-        try:
-            tracemalloc.start()
-            start = time.perf_counter()
 
-            logger.info("Aggregator running...")
-            collectionWasAccessedB4Today = False
-            auctionsFileName = "auctions.json"
+    # The lock only guards the flag: a request during a run returns at once, and the
+    # flag is reset under the lock without nesting it
+    all_data = None
+    try:
+        Profiling.startRun(profile)
+        RunMetrics.startRun()
+        deadline = Deadline()
+        tracemalloc.start()
+        start = time.perf_counter()
 
-            try:
-                lastModifiedDate_local = checkRemoteFileDate()
-                distanceFromAccessTime = datetime.timestamp(datetime.today()) - datetime.timestamp(lastModifiedDate_local)
-                collectionWasAccessedB4Today = int(distanceFromAccessTime) >= 86400 #if 24 hrs (in seconds) or more have passed
-                
-                logger.info(f"Was collection accessed before today? {collectionWasAccessedB4Today}")
-                logger.info(f"Last Access Date (Tirana TZ): {lastModifiedDate_local}")
-                logger.info(f"Time elapsed: ~{int(distanceFromAccessTime / 3600)}hrs")
+        logger.info("Aggregator running...")
+        collectionWasAccessedB4Today = False
+        auctionsFileName = "auctions.json"
+        journal = RunJournal(start_date, end_date)
+
+        try:
+            lastModifiedDate_local = checkRemoteFileDate()
+            distanceFromAccessTime = datetime.timestamp(datetime.today()) - datetime.timestamp(lastModifiedDate_local)
+            collectionWasAccessedB4Today = int(distanceFromAccessTime) >= 86400 #if 24 hrs (in seconds) or more have passed
+            
+            logger.info(f"Was collection accessed before today? {collectionWasAccessedB4Today}")
+            logger.info(f"Last Access Date (Tirana TZ): {lastModifiedDate_local}")
+            logger.info(f"Time elapsed: ~{int(distanceFromAccessTime / 3600)}hrs")
+            
+            CONTINUE_AGGREGATION = collectionWasAccessedB4Today
                 
-                CONTINUE_AGGREGATION = collectionWasAccessedB4Today
-                    
-            except FileNotFoundError:
-                logger.info("An auction collection file is not present.")    
-                CONTINUE_AGGREGATION = True 
-
-            if CONTINUE_AGGREGATION:
-                logger.info("Continuing with aggregation...")
-
-                url = os.environ.get("SUPABASE_URL")
-                key = os.environ.get("SUPABASE_KEY")
-
-                all_data = []
-                listLock = threading.Lock()
-                        
-                def getDataFrom(source, start_date, end_date, horizon):
-                    if source == "JAO":
-                        collector = getJao
-                    else:
-                        collector = getSEECAO
-                        
-                    data = collector(start_date, end_date, horizon)
-                    with listLock:
-                        all_data.extend(data)
-                    
-                with ThreadPoolExecutor(max_workers=10) as executor:
-                    # Caution: setting the horizon to Yearly will collect auctions based ONLY on the dates' years (JAO)
-                    executor.submit(getDataFrom, "JAO", start_date, end_date, "Monthly")
-                    executor.submit(getDataFrom, "JAO", start_date, end_date, "Yearly")
-                    executor.submit(getDataFrom, "SEECAO", start_date, end_date, "Monthly")
-                    executor.submit(getDataFrom, "SEECAO", start_date, end_date, "Yearly")
-
-                if not all_data:
-                    logger.info("\nNo Data collected.")
+        except FileNotFoundError:
+            logger.info("An auction collection file is not present.")    
+            CONTINUE_AGGREGATION = True 
+
+        if journal.resumable:
+            logger.info("The previous run over this range left gaps. Resuming it...")
+            CONTINUE_AGGREGATION = True
+
+        if CONTINUE_AGGREGATION:
+            logger.info("Continuing with aggregation...")
+
+            url = os.environ.get("SUPABASE_URL")
+            key = os.environ.get("SUPABASE_KEY")
+
+            # The run follows the plan's work items, phase by phase
+            plan = buildPlan(start_date, end_date, journal, deadline, dryRun=False)
+            logPlan(plan)
+
+            # Shared by the collectors, which append their normalized records to it
+            all_data = newRecordStore()
                     
+            def getDataFrom(source, start_date, end_date, horizon):
+                if source == "JAO":
+                    collector = getJao
                 else:
-                    with open(auctionsFileName, 'w') as file:
-                            file.write(json.dumps(all_data))
-                    logger.info(f"Data successfully exported to {auctionsFileName}")
-                    
-                    aggregation_range = {
-                        "start_date": start_date,
-                        "end_date": end_date
-                    }
+                    collector = getSEECAO
                     
-                    with open("aggregation_range.json", "w") as json_file:
-                        json.dump(aggregation_range, json_file, indent=4)
-                    
-                    uploadToSupa() 
+                collectorStart = time.perf_counter()
+                try:
+                    with Profiling.profileThread():
+                        collector(start_date, end_date, horizon, journal, all_data, deadline)
+                except Exception as e:
+                    # Units this collector completed stay in the journal for the next run
+                    journal.addGap(f"{source}|{horizon}|{start_date:%Y-%m-%d}|{end_date:%Y-%m-%d}", e)
+                RunMetrics.addWall(source, time.perf_counter() - collectorStart)
+
+            for phase in plan["phases"]:
+                # Caution: setting the horizon to Yearly will collect auctions based ONLY on the dates' years (JAO)
+                with ThreadPoolExecutor(max_workers=10) as executor:
+                    for item in plan["work"]:
+                        if item["phase"] != phase:
+                            continue
+                        if "failed" in item:
+                            journal.addGap(f"{item['source']}|{item['horizon']}|{item['start']:%Y-%m-%d}|{item['end']:%Y-%m-%d}", item["failed"])
+                        else:
+                            logger.info(f"Collecting {item['source']} {item['horizon']} auctions from {item['start']} to {item['end']} ({phase}).")
+                            executor.submit(getDataFrom, item["source"], item["start"], item["end"], item["horizon"])
+
+                if phase == "recent":
+                    publishRecent(all_data, start)
 
-            end = time.perf_counter()
-            curr, peak = tracemalloc.get_traced_memory()
-            tracemalloc.stop()
+            publishSpecs()
+            reportInvalidValues()
+
+            if not all_data:
+                logger.info("\nNo Data collected.")
+                
+            else:
+                writeJSONArray(auctionsFileName, all_data)
+                logger.info(f"Data successfully exported to {auctionsFileName}")
                 
-            def convert_size(size_bytes):
-                # Handle the case for 0 bytes
-                if size_bytes == 0:
-                    return "0B"
+                aggregation_range = {
+                    "start_date": start_date,
+                    "end_date": end_date,
+                    "gaps": journal.gaps
+                }
                 
-                # Define the units
-                size_name = ("B", "KB", "MB", "GB", "TB", "PB")
-                i = int((size_bytes).bit_length() - 1) // 10  # Find which unit to use
-                p = 1024 ** i
-                s = size_bytes / p
-                return f"{s:.2f} {size_name[i]}"
-
-            converted_size = convert_size(peak)
-
-            logger.info(f"\nFinished in {end-start:.2f}sec.")
-            logger.info(f"Peak memory usage: {converted_size}.")
-        
-        finally:
-            with main_lock:
-                is_main_running = False
+                with open("aggregation_range.json", "w") as json_file:
+                    json.dump(aggregation_range, json_file, indent=4, default=str)
+                
+                # Merged JAO/SEECAO view per canonical border and period
+                borderViewFile = writeBorderView(all_data)
+
+                try:
+                    # Units that failed this run are not published as removed records
+                    changelogFiles, manifestFiles, expiredFiles = buildChangelog(all_data, downloadFromSupa, complete=not journal.gaps)
+                except Exception as e:
+                    # Without the previous index there is no patch; the next run's covers these changes
+                    logger.warning(f"Failed to build the changelog, publishing without it: {e}")
+                    discardChangelog()
+                    changelogFiles, manifestFiles, expiredFiles = [], [], []
+                try:
+                    uploadToSupa(changelogFiles + [borderViewFile], manifestFiles, expiredFiles)
+                except Exception:
+                    discardChangelog()
+                    raise
+
+            if journal.gaps:
+                logger.warning(f"Aggregation finished with {len(journal.gaps)} gaps. The next run will resume from {journal.fileName}.")
+            else:
+                journal.clear()
+
+        end = time.perf_counter()
+        curr, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+            
+        def convert_size(size_bytes):
+            # Handle the case for 0 bytes
+            if size_bytes == 0:
+                return "0B"
+            
+            # Define the units
+            size_name = ("B", "KB", "MB", "GB", "TB", "PB")
+            i = int((size_bytes).bit_length() - 1) // 10  # Find which unit to use
+            p = 1024 ** i
+            s = size_bytes / p
+            return f"{s:.2f} {size_name[i]}"
+
+        converted_size = convert_size(peak)
+
+        logger.info(f"\nFinished in {end-start:.2f}sec.")
+        logger.info(f"Peak memory usage: {converted_size}.")
+        logger.info(f"RSS: {getRSS() // MiB}MB of a {memoryBudget // MiB}MB budget.")
+    
+    finally:
+        # Removes the store's spill file or database, whether the run succeeded or not
+        if all_data is not None:
+            all_data.close()
+        RunMetrics.finishRun()
+        Profiling.stopRun()
+        with main_lock:
+            is_main_running = False
@@ -1,16 +1,77 @@
-import logging
+import os
 import sys
+import time
+import queue
+import atexit
+import logging
+import threading
+from logging.handlers import QueueHandler, QueueListener
+
+logFormat = "%(asctime)s [%(levelname)s] %(message)s"
+logLevel = os.environ.get("LOG_LEVEL", "INFO").upper()
+progressInterval = float(os.environ.get("LOG_PROGRESS_INTERVAL", 5))  # seconds
+
+listener = None
+setupLock = threading.Lock()
 
 def setup_logging():
+    # Every module calls this; the handlers are only installed on the first call.
+    # Records are handed to a queue and formatted and written by a listener thread.
+    global listener
     logger = logging.getLogger("my_fastapi_app")
-    logger.setLevel(logging.INFO)
 
-    # Create console handler
-    stream_handler = logging.StreamHandler(sys.stdout)
-    log_formatter = logging.Formatter("%(asctime)s [%(levelname)s] %(message)s")
-    stream_handler.setFormatter(log_formatter)
+    with setupLock:
+        if listener is None:
+            logger.setLevel(logLevel)
+
+            # Create console handler
+            stream_handler = logging.StreamHandler(sys.stdout)
+            log_formatter = logging.Formatter(logFormat)
+            stream_handler.setFormatter(log_formatter)
+
+            log_queue = queue.SimpleQueue()
+            listener = QueueListener(log_queue, stream_handler, respect_handler_level=True)
+            listener.start()
+            atexit.register(listener.stop)
 
-    # Add handler to the logger
-    logger.addHandler(stream_handler)
+            # Add handler to the logger
+            logger.addHandler(QueueHandler(log_queue))
 
     return logger
+
+def addListenerHandler(handler):
+    # Adds a handler fed by the listener thread, e.g. the SSE log stream
+    setup_logging()
+    listener.handlers = listener.handlers + (handler,)
+
+
+class ProgressLog:
+    # Summarizes per-request messages into one progress line per interval
+    def __init__(self, logger, label, total = None):
+        self.logger = logger
+        self.label = label
+        self.total = total
+        self.counts = {}
+        self.lock = threading.Lock()
+        self.loggedAt = time.monotonic()
+
+    def update(self, outcome = "done"):
+        with self.lock:
+            self.counts[outcome] = self.counts.get(outcome, 0) + 1
+            now = time.monotonic()
+            if now - self.loggedAt < progressInterval:
+                return
+            self.loggedAt = now
+            line = self.line()
+        self.logger.info(line)
+
+    def line(self):
+        completed = sum(self.counts.values())
+        progress = f"{completed}/{self.total}" if self.total is not None else f"{completed}"
+        details = ", ".join(f"{count} {outcome}" for outcome, count in sorted(self.counts.items()))
+        return f"{self.label}: {progress} ({details})." if details else f"{self.label}: {progress}."
+
+    def finish(self):
+        with self.lock:
+            line = self.line()
+        self.logger.info(line)
@@ -7,25 +7,19 @@ import asyncio
 import queue
 import logging
 from fastapi import FastAPI, Request, BackgroundTasks, HTTPException
-from fastapi.responses import HTMLResponse
+from fastapi.responses import HTMLResponse, FileResponse
 from starlette.responses import StreamingResponse
 
-from aggregate import main
+from logging_config import setup_logging, addListenerHandler
 
 # Set up a global logger
-logger = logging.getLogger("my_fastapi_app")
-logger.setLevel(logging.INFO)
+logger = setup_logging()
 
 app = FastAPI()
 
 LOG_STREAM = False      # Stream Logs over SSE (GET)
 
 if LOG_STREAM:
-    # Create a console handler for logging
-    console_handler = logging.StreamHandler(sys.stdout)
-    console_handler.setFormatter(logging.Formatter("%(asctime)s [%(levelname)s] %(message)s"))
-    logger.addHandler(console_handler)
-
     # Thread-safe queue for logs
     log_thread_queue = queue.Queue()
 
@@ -36,10 +30,10 @@ if LOG_STREAM:
             msg = self.format(record)
             log_thread_queue.put(msg)
             
-    # Add the QueueHandler to the logger
+    # Fed by the logging listener thread, next to the console handler
     queue_handler = QueueHandler()
     queue_handler.setFormatter(logging.Formatter("%(asctime)s [%(levelname)s] %(message)s"))
-    logger.addHandler(queue_handler)
+    addListenerHandler(queue_handler)
 
     log_queue = asyncio.Queue()
     
@@ -97,6 +91,13 @@ if LOG_STREAM:
         return StreamingResponse(generate_logs(), media_type="text/event-stream")
         
 
+def runAggregation(start_date, end_date, profile = False):
+    # The collectors and storage clients are only imported on the first aggregation,
+    # so uvicorn can bind the port without loading them
+    from aggregate import main
+    main(start_date, end_date, profile)
+
+
 @app.get("/", response_class=HTMLResponse)
 async def get():
     logger.info("GET request received at root endpoint.")
@@ -104,10 +105,8 @@ async def get():
 
 from datetime import datetime
 
-@app.post("/run-main")
-async def run_main(request: Request, background_tasks: BackgroundTasks):
-    """Trigger the main function if the secret phrase is correct and validate optional dates."""
-    body = await request.json()
+def parseRunDates(body):
+    """Validate the secret phrase and the optional dates of a run request."""
     secret = body.get("secret")
     start_date = body.get("start_date")
     end_date = body.get("end_date")
@@ -140,35 +139,90 @@ async def run_main(request: Request, background_tasks: BackgroundTasks):
         logger.warning("Start date is after the end date.")
         raise HTTPException(status_code=400, detail="Bad Request: Start date cannot be after end date.")
 
+    return parsed_start_date, parsed_end_date
+
+
+@app.post("/run-main")
+async def run_main(request: Request, background_tasks: BackgroundTasks):
+    """Trigger the main function if the secret phrase is correct and validate optional dates."""
+    body = await request.json()
+    start_date = body.get("start_date")
+    end_date = body.get("end_date")
+    profile = bool(body.get("profile", False))
+    parsed_start_date, parsed_end_date = parseRunDates(body)
+
     logger.info("POST request received with valid parameters.")
     logger.info(f"Start date: {parsed_start_date}, End date: {parsed_end_date}")
 
     # Pass the parsed dates to the main function
-    background_tasks.add_task(main, parsed_start_date, parsed_end_date)
-    return {"message": "Main function started with dates", "start_date": start_date, "end_date": end_date}
+    background_tasks.add_task(runAggregation, parsed_start_date, parsed_end_date, profile)
+    return {"message": "Main function started with dates", "start_date": start_date, "end_date": end_date, "profile": profile}
+
+
+@app.post("/plan")
+async def plan(request: Request):
+    """Dry run: the work units, requests, bytes and duration /run-main would take with these dates."""
+    body = await request.json()
+    parsed_start_date, parsed_end_date = parseRunDates(body)
+
+    # Planning reads the journal and may look up the corridors and borders, off the event loop
+    from RunPlanner import buildPlan
+    return await asyncio.to_thread(buildPlan, parsed_start_date, parsed_end_date,
+                                   details=bool(body.get("details", False)))
+
+
+@app.get("/profiles")
+async def list_profiles(secret: str = ""):
+    """List the saved run profiles and their artifacts."""
+    if secret != SECRET_PHRASE:
+        raise HTTPException(status_code=403, detail="Forbidden: Invalid secret phrase")
+
+    from Profiling import listProfiles
+    return listProfiles()
+
+
+@app.get("/profiles/{run}/{artifact}")
+async def get_profile(run: str, artifact: str, secret: str = ""):
+    """Download one artifact of a saved run profile."""
+    if secret != SECRET_PHRASE:
+        raise HTTPException(status_code=403, detail="Forbidden: Invalid secret phrase")
+
+    from Profiling import listProfiles
+    if artifact not in listProfiles().get(run, ()):
+        raise HTTPException(status_code=404, detail="Not Found: No such profile artifact")
+
+    from Profiling import profilesDir
+    return FileResponse(os.path.join(profilesDir, run, artifact))
+
+
+@app.get("/storage/{name}")
+async def get_published(name: str, secret: str = ""):
+    """Serve a published file when STORAGE_BACKEND is local."""
+    if secret != SECRET_PHRASE:
+        raise HTTPException(status_code=403, detail="Forbidden: Invalid secret phrase")
+
+    from StorageBackend import storageBackend, getBackend
+    if storageBackend != "local":
+        raise HTTPException(status_code=404, detail="Not Found: Files are published to Supabase")
+
+    backend = getBackend()
+    try:
+        entry = backend.stat(name)
+    except ValueError:
+        entry = None
+    if entry is None:
+        raise HTTPException(status_code=404, detail="Not Found: No such file")
+
+    # Streamed from a memory map of the version published when the request started
+    return StreamingResponse(backend.readMapped(name), media_type="application/json")
 
 
 if __name__ == "__main__":
     import uvicorn
-    import resource
     import sys
 
-    def get_memory():
-        with open('/proc/meminfo', 'r') as mem:
-            free_memory = 0
-            for i in mem:
-                sline = i.split()
-                if str(sline[0]) in ('MemFree:', 'Buffers:', 'Cached:'):
-                    free_memory += int(sline[1])
-        return free_memory  # KiB
-
-    def memory_limit_half():
-        """Limit max memory usage to half."""
-        soft, hard = resource.getrlimit(resource.RLIMIT_AS)
-        # Convert KiB to bytes, and divide in two to half
-        resource.setrlimit(resource.RLIMIT_AS, (int(get_memory() * 1024 / 2), hard))
-
-    memory_limit_half()
+    # Memory is bounded by MEMORY_BUDGET_MB (see MemoryBudget.py): the collectors throttle
+    # and spill to disk as RSS nears it, instead of failing against an RLIMIT_AS cap
     try:
         uvicorn.run(app, host="0.0.0.0", port=8080)
     except MemoryError:
@@ -0,0 +1,62 @@
+import os
+import sys
+import time
+import subprocess
+import statistics
+import urllib.request
+import urllib.error
+
+from logging_config import setup_logging
+logger = setup_logging()
+
+# Measures server cold start: the import time of server.py and the time from
+# process start to the first successful response on "/". Import times are those
+# of a fresh interpreter minus its startup, measured with "python -c pass".
+#   python startupBenchmark.py [runs]
+
+here = os.path.dirname(os.path.abspath(__file__))
+url = "http://127.0.0.1:8080/"
+
+
+def runTime(code):
+    start = time.perf_counter()
+    subprocess.run([sys.executable, "-c", code], cwd=here, check=True)
+    return time.perf_counter() - start
+
+
+def importTime(module, baseline):
+    return runTime(f"import {module}") - baseline
+
+
+def timeToFirstResponse(timeout = 60):
+    start = time.perf_counter()
+    process = subprocess.Popen([sys.executable, "server.py"], cwd=here,
+                               stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    try:
+        while time.perf_counter() - start < timeout:
+            if process.poll() is not None:
+                raise Exception(f"server.py exited with code {process.returncode}")
+            try:
+                with urllib.request.urlopen(url, timeout=1) as response:
+                    if response.status == 200:
+                        return time.perf_counter() - start
+            except (urllib.error.URLError, ConnectionError):
+                time.sleep(0.01)
+        raise Exception(f"No response from {url} after {timeout} seconds.")
+    finally:
+        process.terminate()
+        process.wait()
+
+
+if __name__ == "__main__":
+    runs = int(sys.argv[1]) if len(sys.argv) > 1 else 5
+
+    baseline = statistics.median(runTime("pass") for _ in range(runs))
+    logger.info(f"Interpreter startup: median {baseline:.3f}sec over {runs} runs.")
+
+    for module in ("server", "aggregate"):
+        samples = [importTime(module, baseline) for _ in range(runs)]
+        logger.info(f"import {module}: median {statistics.median(samples):.3f}sec over {runs} runs.")
+
+    samples = [timeToFirstResponse() for _ in range(runs)]
+    logger.info(f"First response on /: median {statistics.median(samples):.3f}sec over {runs} runs.")
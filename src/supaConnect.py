@@ -1,16 +1,17 @@
-from dotenv import load_dotenv
-load_dotenv()
-
 import os
-from supabase import create_client
-from supabase.client import ClientOptions
-from storage3.utils import StorageException
+from datetime import datetime, timezone
+
+from StorageBackend import getBackend
 from logging_config import setup_logging
 logger = setup_logging()
 
 auctionsFileName = "auctions.json"
+BUCKET_NAME = 'capmap-storage'
+
+def signIn():
+    from supabase import create_client
+    from supabase.client import ClientOptions
 
-def uploadToSupa():
     url = os.environ.get("SUPABASE_URL")
     key = os.environ.get("SUPABASE_KEY")
 
@@ -26,132 +27,165 @@ def uploadToSupa():
 
     email = os.environ.get("SUPABASE_USER")
     passw = os.environ.get("SUPABASE_USER_PASS")
-    session = None
     logger.info("Signing in...")
     try:
-        session = supabase.auth.sign_in_with_password({
+        supabase.auth.sign_in_with_password({
             "email": email, "password":passw
         })
     except Exception as e:
         SIGN_OUT()
         raise Exception(f"Unhandled Error:\n{e}")
-        
-        
-    BUCKET_NAME = 'capmap-storage'
 
+    return supabase
+
+
+listPageSize = 1000
+
+def listBucket(supabase, search = None):
+    # Every object of the bucket, page by page, or those whose name contains search
     logger.info("Getting list of bucket files...")
-    response = supabase.storage.from_(BUCKET_NAME).list(
-    "",
-    {"limit": 10, "offset": 0, "sortBy": {"column": "name", "order": "desc"}},
-    )
-
-    auctionsFileName = "auctions.json"
-    UPSERT = "false"
-    if response:
-        for item in response:
-            if item["name"] == auctionsFileName:
-                logger.info(f"{auctionsFileName} already exists. It will be overwritten by the local version.")
-                UPSERT = "true"
-
-        
-    logger.info("Uploading auctions...")
-    with open(auctionsFileName, 'rb') as f:
+    items = []
+    while True:
+        options = {"limit": listPageSize, "offset": len(items), "sortBy": {"column": "name", "order": "desc"}}
+        if search is not None:
+            options["search"] = search
+        page = supabase.storage.from_(BUCKET_NAME).list("", options) or []
+        items.extend(page)
+        if len(page) < listPageSize:
+            return items
+
+
+def findObject(supabase, name):
+    # The bucket's listing entry of this object, or None
+    for item in listBucket(supabase, search=name):
+        if item["name"] == name:
+            return item
+    return None
+
+
+def toEntry(item):
+    # StorageBackend entry of a listing item, None for folders (they have no timestamps)
+    updated = item.get("updated_at") or item.get("created_at")
+    if not updated:
+        return None
+    return {
+        "name": item["name"],
+        "size": (item.get("metadata") or {}).get("size"),
+        "updated_at": datetime.strptime(updated[:-1], "%Y-%m-%dT%H:%M:%S.%f").replace(tzinfo=timezone.utc),
+    }
+
+
+class SupabaseBackend:
+    # StorageBackend over the capmap-storage bucket
+    def list(self):
+        supabase = signIn()
         try:
-            response = supabase.storage.from_(BUCKET_NAME).upload(
-                file=f,
-                path=auctionsFileName,
-                file_options={"cache-control": "3600", "upsert": UPSERT},
-            )
-            logger.info(response)
-        except StorageException as e:
-            SIGN_OUT()
-            raise Exception(e)
-    
-    logger.info("Uploading date ranges...")
-    with open("aggregation_range.json", 'rb') as f:
+            response = listBucket(supabase)
+        finally:
+            supabase.auth.sign_out()
+        return [entry for entry in map(toEntry, response) if entry is not None]
+
+    def stat(self, name):
+        supabase = signIn()
         try:
-            response = supabase.storage.from_(BUCKET_NAME).upload(
-                file=f,
-                path="aggregation_range.json",
-                file_options={"cache-control": "3600", "upsert": UPSERT},
-            )
-            logger.info(response)
-        except StorageException as e:
+            item = findObject(supabase, name)
+        finally:
+            supabase.auth.sign_out()
+        return toEntry(item) if item is not None else None
+
+    def put(self, fileNames):
+        # Uploads the files concurrently; large files go through resumable chunked uploads
+        import asyncio
+        from StorageUpload import StorageUploader
+
+        supabase = signIn()
+        SIGN_OUT = supabase.auth.sign_out
+
+        try:
+            files = {}
+            for fileName in fileNames:
+                if findObject(supabase, os.path.basename(fileName)) is not None:
+                    logger.info(f"{fileName} already exists. It will be overwritten by the local version.")
+                    files[fileName] = True
+                else:
+                    files[fileName] = False
+
+            # SUPABASE_STORAGE_URL can point the uploads at LocalStorageServer
+            storageUrl = os.environ.get("SUPABASE_STORAGE_URL") or f"{os.environ.get('SUPABASE_URL')}/storage/v1"
+            headers = {
+                "apikey": os.environ.get("SUPABASE_KEY"),
+                "Authorization": f"Bearer {supabase.auth.get_session().access_token}",
+            }
+
+            logger.info(f"Uploading {', '.join(files)}...")
+            asyncio.run(StorageUploader(storageUrl, BUCKET_NAME, headers).uploadFiles(files))
+        finally:
             SIGN_OUT()
-            raise Exception(e)
 
-            
-    SIGN_OUT()
-    
-    
-    
-def checkRemoteFileDate():
-    from datetime import datetime
-    import pytz
-    
-    logger.info("Initiating last update check...")
-    
-    url = os.environ.get("SUPABASE_URL")
-    key = os.environ.get("SUPABASE_KEY")
+    def delete(self, names):
+        supabase = signIn()
+        try:
+            supabase.storage.from_(BUCKET_NAME).remove(list(names))
+        finally:
+            supabase.auth.sign_out()
 
-    logger.info("Connecting to Supabase...")
-    supabase = create_client(url, key,
-    options=ClientOptions(
-        postgrest_client_timeout=10,
-        storage_client_timeout=10,
-        schema="public",
-    ))
+    def get(self, name):
+        from storage3.utils import StorageException
 
-    SIGN_OUT = supabase.auth.sign_out
+        supabase = signIn()
+        try:
+            logger.info(f"Downloading {name}...")
+            return supabase.storage.from_(BUCKET_NAME).download(name)
+        except StorageException:
+            logger.info(f"{name} was not found in the bucket.")
+            return None
+        finally:
+            supabase.auth.sign_out()
+
+
+def uploadToSupa(extraFiles = (), manifestFiles = (), expiredFiles = ()):
+    # The manifests go up one by one, and only once every other file is published:
+    # a failed upload never leaves a version announced without its data. Expired files
+    # are deleted last, once no published manifest lists them.
+    backend = getBackend()
+    backend.put([auctionsFileName, "aggregation_range.json", *extraFiles])
+    for fileName in manifestFiles:
+        backend.put([fileName])
+    if expiredFiles:
+        try:
+            backend.delete(expiredFiles)
+            logger.info(f"Deleted {', '.join(expiredFiles)}.")
+        except Exception as e:
+            # A leftover patch is only wasted space, no manifest lists it
+            logger.warning(f"Failed to delete {', '.join(expiredFiles)}: {e}")
 
-    email = os.environ.get("SUPABASE_USER")
-    passw = os.environ.get("SUPABASE_USER_PASS")
-    session = None
-    logger.info("Signing in...")
-    try:
-        session = supabase.auth.sign_in_with_password({
-            "email": email, "password":passw
-        })
-    except Exception as e:
-        SIGN_OUT()
-        raise Exception(f"Unhandled Error:\n{e}")
-        
-        
-    BUCKET_NAME = 'capmap-storage'
 
-    logger.info("Getting list of bucket files...")
-    response = supabase.storage.from_(BUCKET_NAME).list(
-    "",
-    {"limit": 10, "offset": 0, "sortBy": {"column": "name", "order": "desc"}},
-    )
+def downloadFromSupa(fileName):
+    # Returns the file's bytes, or None if it is not published
+    return getBackend().get(fileName)
 
-    if not response:
-        logger.info("No remote files were found.")
-        return None
 
-    for item in response:
-        if item["name"] == auctionsFileName:
-            try:
-                responseData = item["updated_at"]
-            except:
-                logger.info("No updated_at value was found, using creation date...")
-                responseData = item["created_at"]
-                
-    lastModifiedDate = datetime.strptime(responseData[:-1], "%Y-%m-%dT%H:%M:%S.%f")
-    
-    # Set the object's timezone to UTC
-    lastModifiedDate_UTC = lastModifiedDate.replace(tzinfo=pytz.utc)
+def checkRemoteFileDate():
+    import pytz
+
+    logger.info("Initiating last update check...")
+
+    entry = getBackend().stat(auctionsFileName)
+    if entry is None:
+        logger.info("No remote auction collection was found.")
+        raise FileNotFoundError(auctionsFileName)
 
     # Define the Tirana timezone
     tirana_tz = pytz.timezone("Europe/Tirane")
 
     # Convert UTC datetime to Tirana time
-    lastModifiedDate_local = lastModifiedDate_UTC.astimezone(tirana_tz)
+    lastModifiedDate_local = entry["updated_at"].astimezone(tirana_tz)
 
-    SIGN_OUT()
     return lastModifiedDate_local
-    
+
 if __name__ == "__main__":
+    from dotenv import load_dotenv
+    load_dotenv()
+
     response = checkRemoteFileDate()
     logger.info(response)
-    
\ No newline at end of file